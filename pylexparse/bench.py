@@ -0,0 +1,294 @@
+"""Benchmarks for each stage of matching and lexing.
+
+Run them with `pylexparse.py bench`.  Results are printed as JSON, with
+each benchmark's name mapped to its best time.  They are compared against
+a baseline file of earlier results.  Any benchmark that got slower than
+the baseline by more than the tolerance is reported, and the exit status
+is nonzero.
+
+Machines and their loads differ, so times aren't in seconds, but in
+multiples of the time a fixed workload of plain Python takes.  That
+calibration workload is timed right alongside each run of a benchmark.
+Each benchmark's workload is repeated until it takes at least MIN_TIME,
+so that timer noise stays small beside it.
+
+Even so, a benchmark's time can vary by a third between processes.  Save
+baselines from several --runs, which records each benchmark's median.
+A benchmark that seems to have regressed is run again, up to RERUNS
+more times, and only counts as slower if it is slower every time.
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+import charsource
+import finiteautomata
+import lexer
+import pattern
+import regex
+
+# The stored baseline timings.
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+# How much slower than its baseline a benchmark may get, as a fraction.
+DEFAULT_TOLERANCE = 0.5
+
+# How many times each benchmark runs.  The fastest run counts.
+DEFAULT_REPEATS = 5
+
+# The least time, in seconds, that one timed run of a benchmark may take.
+MIN_TIME = 0.1
+
+# How many more times a benchmark that seems slower is run.
+RERUNS = 2
+
+GRAMMARS = {
+    'c': [
+        lexer.Rule('IDENTIFIER', '[a-zA-Z_][a-zA-Z0-9_]*'),
+        lexer.Rule('KEYWORD',
+                   'if|else|while|for|return|int|char|void|struct|break'),
+        lexer.Rule('NUMBER', r'[0-9]+(\.[0-9]+)?'),
+        lexer.Rule('STRING', '"[^"]*"'),
+        lexer.Rule('OPERATOR', r'==|!=|<=|>=|&&|\|\||[+*/%<>=!&|-]'),
+        lexer.Rule('PUNCTUATION', '[(){};,]'),
+        lexer.Rule('WHITESPACE', r'\s+', emitted=False),
+        ],
+    'json': [
+        lexer.Rule('STRING', '"[^"]*"'),
+        lexer.Rule('NUMBER', r'-?[0-9]+(\.[0-9]+)?([eE][-+]?[0-9]+)?'),
+        lexer.Rule('LITERAL', 'true|false|null'),
+        lexer.Rule('PUNCTUATION', r'[{},:]|\[|]'),
+        lexer.Rule('WHITESPACE', r'\s+', emitted=False),
+        ],
+    }
+
+# Tokens to build each grammar's corpus from.
+_CORPUS_TOKENS = {
+    'c': ['int', 'x', 'count_2', 'while', '(', ')', '{', '}', ';', '==', '+',
+          '42', '3.14', '"hello, world"', 'return', 'struct', 'node', '&&',
+          'if', 'else', 'buffer_size', ',', '-', 'i'],
+    'json': ['{', '}', '[', ']', ':', ',', '"key"', '"a longer value"',
+             '-12', '3.5e10', '0', 'true', 'false', 'null'],
+    }
+
+# Patterns that are hard to compile or run, and subjects to run them on.
+PATHOLOGICAL = {
+    'large_repeat': ('[0-9]{1,300}x', '7' * 300 + 'x'),
+    'nested_stars': ('((a*)*b*)*c|(((ab)*)*a)*', 'ab' * 200),
+    'negated_class': ('[^xyz]{1,40}z|[^a-m]+', 'q' * 400),
+    'dfa_blowup': ('(a|b)*a(a|b){8}', 'ab' * 200),
+    }
+
+
+def corpus(grammar, size=5000):
+    """Return a fixed text of about size characters for a grammar."""
+    rand = random.Random(grammar)
+    tokens = _CORPUS_TOKENS[grammar]
+    parts = []
+    length = 0
+    while length < size:
+        token = rand.choice(tokens)
+        separator = '\n' if rand.random() < 0.1 else ' '
+        parts.append(token + separator)
+        length += len(token) + 1
+    return ''.join(parts)
+
+
+def _calibrate(unused_argument):
+    """Do a fixed amount of dict and arithmetic work in plain Python."""
+    counts = {}
+    for i in xrange(20000):
+        counts[i % 97] = counts.get(i % 97, 0) + i
+
+
+def _benchmarks():
+    """Yield a (name, setup, run) tuple for each benchmark.
+
+    setup() is untimed, and returns the argument to run().
+    """
+    for name, rules in sorted(GRAMMARS.iteritems()):
+        regexes = [rule.regex for rule in rules]
+
+        def parse(regexes):
+            for _ in range(50):
+                regex.parse_cache.clear()
+                for regex_string in regexes:
+                    regex.parse_regex(regex_string)
+        yield 'parse_regex/%s' % name, lambda regexes=regexes: regexes, parse
+
+    cases = [(name, regex_string, subject)
+             for name, (regex_string, subject) in sorted(PATHOLOGICAL.iteritems())]
+    for name, regex_string, subject in cases:
+        def setup_compile(regex_string=regex_string):
+            # Fresh patterns, which haven't memoized their simplified forms.
+            regex.parse_cache.clear()
+            return [regex.parse_regex('(' * depth + regex_string + ')' * depth)
+                    for depth in range(5)]
+        def compiled(patterns, engine):
+            for pat in patterns:
+                pattern.compile_cache.clear()
+                pat.compiled(engine)
+        for engine in ('nfa', 'table'):
+            yield ('compiled/%s/%s' % (name, engine), setup_compile,
+                   lambda patterns, engine=engine: compiled(patterns, engine))
+
+        def setup_nfa(regex_string=regex_string):
+            pattern.compile_cache.clear()
+            return regex.parse_regex(regex_string).compiled()
+        yield 'nfa_to_dfa/%s' % name, setup_nfa, finiteautomata.nfa_to_dfa
+
+        def longest_match(nfa, subject=subject):
+            for _ in range(10):
+                nfa.longest_match(charsource.RewindSource(subject))
+        yield 'longest_match/%s' % name, setup_nfa, longest_match
+
+    for name, rules in sorted(GRAMMARS.iteritems()):
+        text = corpus(name)
+        for engine in finiteautomata.ENGINES:
+            lex_ = lexer.Lexer(rules, engine)
+            yield ('lex/%s/%s' % (name, engine), lambda lex_=lex_: lex_,
+                   lambda lex_, text=text: list(lex_.lex(text)))
+
+        lex_ = lexer.Lexer(rules, 'table')
+        for mapped in (False, True):
+            def setup_file(text=text):
+                open_file = tempfile.TemporaryFile()
+                open_file.write(text)
+                open_file.flush()
+                open_file.seek(0)
+                return open_file
+            def lex_file(open_file, lex_=lex_, mapped=mapped):
+                with open_file:
+                    list(lex_.lex_file(open_file, mapped))
+            yield ('lex_file/%s/%s' % (name, 'mapped' if mapped else 'read'),
+                   setup_file, lex_file)
+
+
+def _time(setup, run_once, number):
+    """Return the time that number runs take, not counting their setups.
+
+    As in timeit, the garbage collector is off while timing, so that its
+    passes over earlier benchmarks' garbage don't count.
+    """
+    arguments = [setup() for _ in range(number)]
+    gc.collect()
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = timeit.default_timer()
+        for argument in arguments:
+            run_once(argument)
+        return timeit.default_timer() - start
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _autorange(setup, run_once, min_time):
+    """Return how many runs it takes to fill min_time, like timeit does."""
+    number = 1
+    while _time(setup, run_once, number) < min_time:
+        number *= 2
+    return number
+
+
+def run(name_filter='', repeats=DEFAULT_REPEATS, min_time=MIN_TIME,
+        names=None):
+    """Run the benchmarks whose names contain name_filter.
+
+    If names is given, only the benchmarks it names are run.
+
+    Each timed run repeats a benchmark's workload until it takes at least
+    min_time, and is paired with a run of the calibration workload.
+
+    Return a dict mapping each benchmark's name to its best time for one
+    workload, as a multiple of the calibration workload's best time.
+    """
+    no_setup = lambda: None
+    calibration_number = _autorange(no_setup, _calibrate, min_time)
+    results = {}
+    for name, setup, run_once in _benchmarks():
+        if name_filter not in name or (names is not None and
+                                       name not in names):
+            continue
+        number = _autorange(setup, run_once, min_time)
+        calibration_times = []
+        times = []
+        for _ in range(repeats):
+            calibration_times.append(
+                _time(no_setup, _calibrate, calibration_number))
+            times.append(_time(setup, run_once, number))
+        results[name] = ((min(times) / number) /
+                         (min(calibration_times) / calibration_number))
+    return results
+
+
+def regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Find the benchmarks that got slower than their baselines.
+
+    Return a sorted list of (name, baseline time, time) tuples.
+    Benchmarks missing from either side are ignored.
+    """
+    return sorted((name, baseline[name], time)
+                  for name, time in results.iteritems()
+                  if name in baseline and time > baseline[name] * (1 + tolerance))
+
+
+def median_results(runs):
+    """Combine the results of several runs, by each benchmark's median."""
+    return dict((name, sorted(result[name] for result in runs)[len(runs) // 2])
+                for name in runs[0])
+
+
+def main(args):
+    """Run the benchmarks from the command line.  Return the exit status."""
+    parser = argparse.ArgumentParser(prog='pylexparse.py bench')
+    parser.add_argument('--filter', default='',
+                        help='only run benchmarks whose names contain this')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--runs', type=int, default=1,
+                        help='run everything this many times, and report '
+                        'the median')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='the JSON file of timings to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='the allowed slowdown, as a fraction')
+    parser.add_argument('--save', metavar='PATH',
+                        help='write the results here, as a new baseline')
+    options = parser.parse_args(args)
+
+    results = median_results([run(options.filter, options.repeats)
+                              for _ in range(options.runs)])
+    output = json.dumps(results, indent=2, sort_keys=True,
+                        separators=(',', ': '))
+    print output
+
+    if options.save:
+        with open(options.save, 'w') as save_file:
+            print >>save_file, output
+
+    if not os.path.exists(options.baseline):
+        return 0
+    with open(options.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    slower = regressions(results, baseline, options.tolerance)
+    for _ in range(RERUNS):
+        if not slower:
+            break
+        slower_names = set(name for name, unused_baseline_time, unused_time
+                           in slower)
+        rerun = run(repeats=options.repeats, names=slower_names)
+        for name, time in rerun.iteritems():
+            results[name] = min(results[name], time)
+        slower = regressions(results, baseline, options.tolerance)
+    for name, baseline_time, time in slower:
+        print >>sys.stderr, 'REGRESSION %s: %.3f -> %.3f (%+.0f%%)' % (
+            name, baseline_time, time, (time / baseline_time - 1) * 100)
+    return 1 if slower else 0
@@ -0,0 +1,29 @@
+"""Unit tests for bench."""
+import unittest
+
+import bench
+
+class TestBench(unittest.TestCase):
+    def test_run(self):
+        results = bench.run('parse_regex', repeats=1, min_time=0)
+        self.assertEqual(['parse_regex/c', 'parse_regex/json'], sorted(results))
+
+    def test_run_named(self):
+        results = bench.run(repeats=1, min_time=0, names=['parse_regex/c'])
+        self.assertEqual(['parse_regex/c'], sorted(results))
+
+    def test_median_results(self):
+        runs = [{'a': 3.0, 'b': 1.0}, {'a': 1.0, 'b': 1.5}, {'a': 2.0, 'b': 9.0}]
+        self.assertEqual({'a': 2.0, 'b': 1.5}, bench.median_results(runs))
+
+    def test_corpus_is_fixed(self):
+        self.assertEqual(bench.corpus('c'), bench.corpus('c'))
+
+    def test_regressions(self):
+        baseline = {'fast': 1.0, 'slow': 1.0, 'gone': 1.0}
+        results = {'fast': 1.2, 'slow': 1.8, 'new': 5.0}
+        self.assertEqual([('slow', 1.0, 1.8)],
+                         bench.regressions(results, baseline, tolerance=0.5))
+
+if __name__ == '__main__':
+    unittest.main()
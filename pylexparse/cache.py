@@ -0,0 +1,60 @@
+"""A least-recently-used cache, for memoizing expensive compilation."""
+
+import collections
+
+# The default number of entries an LruCache holds.
+DEFAULT_MAX_SIZE = 256
+
+
+class LruCache(object):
+    """Maps keys to values, forgetting the least recently used beyond a limit.
+
+    Counts hits and misses, so callers can tell whether caching pays off.
+    A max_size of 0 disables caching entirely.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, compute):
+        """Return the value for a key.
+
+        On a miss, compute() produces the value, which is then cached.
+        """
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            value = compute()
+            if self.max_size <= 0:
+                return value
+            if len(self._entries) >= self.max_size:
+                self._entries.popitem(last=False)
+        else:
+            self.hits += 1
+        # (Re-)inserting puts the key at the most recently used end.
+        self._entries[key] = value
+        return value
+
+    def resize(self, max_size):
+        """Change the size limit, forgetting entries if necessary."""
+        self.max_size = max_size
+        while len(self._entries) > max(max_size, 0):
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Forget all entries, and reset the statistics."""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        """Return the fraction of lookups that were hits."""
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
@@ -0,0 +1,104 @@
+"""Partitioning characters into classes that an automaton treats alike."""
+
+import bisect
+
+# The class of characters that no transition mentions.
+NO_CLASS = -1
+
+
+def char(code):
+    """Return the character with a code point, as a str if it is ASCII."""
+    return chr(code) if code < 128 else unichr(code)
+
+
+def label_bounds(label):
+    """Return the inclusive (low, high) code points of a character or range label."""
+    if isinstance(label, tuple):
+        low, high = label
+        return ord(low), ord(high)
+    return ord(label), ord(label)
+
+
+class CharClasses(object):
+    """The coarsest partition of characters that respects some transition labels.
+
+    A label is a character, a (low, high) tuple of characters standing
+    for the inclusive range between them, None for the EOF, or '' for
+    an empty transition (which is ignored).  Every label covers a whole
+    number of classes, so transitions can be looked up by class rather
+    than by character, and ranges never need to be expanded.
+
+    Classes are numbered from 0.  Class i holds the code points from
+    boundaries[i] up to (not including) boundaries[i + 1].  If there
+    are EOF labels, the EOF has the last class of its own.
+    """
+
+    def __init__(self, boundaries, has_eof):
+        self.boundaries = list(boundaries)
+        self.has_eof = has_eof
+        num_intervals = max(len(self.boundaries) - 1, 0)
+        self.eof_class = num_intervals if has_eof else NO_CLASS
+        self.num_classes = num_intervals + (1 if has_eof else 0)
+        # Maps character -> class, for characters seen so far.
+        self._cache = {}
+
+    @classmethod
+    def from_labels(cls, labels):
+        """Build the classes for an iterable of transition labels."""
+        bounds = set()
+        has_eof = False
+        for label in labels:
+            if label is None:
+                has_eof = True
+            elif label != '':
+                low, high = label_bounds(label)
+                bounds.add(low)
+                bounds.add(high + 1)
+        return cls(sorted(bounds), has_eof)
+
+    def classify(self, character):
+        """Return the class of a character (or the EOF), or NO_CLASS."""
+        try:
+            return self._cache[character]
+        except KeyError:
+            pass
+        if character is None:
+            result = self.eof_class
+        else:
+            boundaries = self.boundaries
+            i = bisect.bisect_right(boundaries, ord(character)) - 1
+            result = i if 0 <= i < len(boundaries) - 1 else NO_CLASS
+        self._cache[character] = result
+        return result
+
+    def classes_of(self, label):
+        """Return the list of classes a transition label covers."""
+        if label is None:
+            return [self.eof_class]
+        low, high = label_bounds(label)
+        return range(bisect.bisect_left(self.boundaries, low),
+                     bisect.bisect_left(self.boundaries, high + 1))
+
+    def representative(self, class_id):
+        """Return a character (or None, for the EOF) in a class."""
+        if class_id == self.eof_class:
+            return None
+        return char(self.boundaries[class_id])
+
+    def labels(self, class_ids):
+        """Return the fewest labels that cover exactly some classes."""
+        result = []
+        run_start = previous = None
+        for class_id in sorted(class_ids) + [None]:
+            if class_id == self.eof_class:
+                result.append(None)
+                continue
+            if previous is not None and class_id == previous + 1:
+                previous = class_id
+                continue
+            if run_start is not None:
+                low = self.boundaries[run_start]
+                high = self.boundaries[previous + 1] - 1
+                result.append(char(low) if low == high else (char(low), char(high)))
+            run_start = previous = class_id
+        return result
@@ -1,6 +1,10 @@
 """Tools for getting and ungetting input characters."""
 
 import collections
+import mmap
+
+# Types that can be indexed and sliced by position, yielding characters.
+_BUFFER_TYPES = (str, unicode, buffer, memoryview, mmap.mmap)
 
 class GetPutSource(object):
     """An input source with getc() and ungetc() equivalents."""
@@ -64,6 +68,42 @@ class RewindSource(object):
             self._source.put(self._read.pop())
 
 
+def is_buffer(candidate):
+    """Return whether an input can be read by position, rather than iterated."""
+    return isinstance(candidate, _BUFFER_TYPES)
+
+
+def full_match(matcher, candidate):
+    """Match a whole candidate against a matcher.
+
+    Buffers are read by position, and other candidates through a
+    RewindSource.  Return the accepting NFA states of the match, or an
+    empty frozenset if the candidate doesn't match all the way.
+    """
+    if is_buffer(candidate):
+        states, end = matcher.longest_match_at(candidate, 0)
+        return states if end == len(candidate) else frozenset()
+    states, match = matcher.longest_match(RewindSource(candidate))
+    return states if match == candidate else frozenset()
+
+
+def can_find(text):
+    """Return whether a text can be searched for a string.
+
+    str, unicode and mmap have a find method.  buffers and memoryviews
+    don't, and their 'in' only compares single items.
+    """
+    return hasattr(text, 'find')
+
+
+def lacks(text, string, start=0):
+    """Return whether a text is known not to contain a string after start.
+
+    Texts that can't be searched are never known to lack anything.
+    """
+    return bool(string) and can_find(text) and text.find(string, start) == -1
+
+
 def chars_in_file(open_file):
     """Yield each character in a file."""
     for line in open_file:
@@ -0,0 +1,231 @@
+"""Generating specialized Python source for DFAs and lexers.
+
+The generated code has no per-character dict lookups.  Each DFA state
+becomes a block of straight-line comparisons against the code points of
+its transitions, and a state that loops on itself scans its run of
+characters in a tight inner loop.  States are dispatched by a binary
+tree of comparisons on the state number.
+
+Generated modules are plain Python with no imports, so they can be
+shipped without pylexparse.
+"""
+
+import hashlib
+import imp
+import os
+import tempfile
+
+import charclasses
+import graph
+import lexer
+
+_HEADER = '# Generated by pylexparse.codegen.  Do not edit.\n'
+
+_MATCH_TEMPLATE = '''
+def longest_match_at(buffer, position, final=True):
+    """Find the longest match in a buffer, starting at a position.
+
+    Return (accept id, end position).  The accept id is None, and the
+    end is the start position, if nothing matched.  If the buffer isn't
+    final and the match could continue past its end, return None.
+    """
+    end = len(buffer)
+    accepted, match_end = None, position
+    state = 0
+    while True:
+%s
+'''
+
+_DFA_TEMPLATE = '''
+def match(candidate):
+    """Return the accept id of a full match of the candidate, or None."""
+    accepted, match_end = longest_match_at(candidate, 0)
+    return accepted if match_end == len(candidate) else None
+'''
+
+_LEXER_TEMPLATE = '''
+def spans(buffer, position=0):
+    """Yield a (rule index, start, end) tuple for every token."""
+    while True:
+        rule, end = longest_match_at(buffer, position)
+        if rule == EOF:
+            return
+        if rule is None:
+            raise ValueError('No token matches at position %d.' % position)
+        yield rule, position, end
+        position = end
+
+
+def lex(text):
+    """Yield a (type name, value) pair for every emitted token."""
+    for rule, start, end in spans(text):
+        name, emitted = RULES[rule]
+        if emitted:
+            yield name, text[start:end]
+'''
+
+
+def _intervals(labels):
+    """Merge character and range labels into sorted (low, high) code points."""
+    intervals = sorted(charclasses.label_bounds(label) for label in labels)
+    merged = []
+    for low, high in intervals:
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = merged[-1][0], max(merged[-1][1], high)
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def _condition(intervals):
+    """Return a Python expression testing whether c is in some intervals."""
+    return ' or '.join('c == %d' % low if low == high else
+                       '%d <= c <= %d' % (low, high)
+                       for low, high in intervals)
+
+
+def _state_lines(state, state_ids, accept_id):
+    """Return the lines of code for one DFA state.
+
+    accept_id is the id the state reports when it accepts, or None.
+    """
+    by_destination = {}
+    eof_destination = None
+    for label, destination in state:
+        if label is None:
+            eof_destination = destination
+        else:
+            by_destination.setdefault(destination, []).append(label)
+
+    lines = []
+    self_labels = by_destination.pop(state, None)
+    if self_labels:
+        lines += ['while position < end:',
+                  '    c = ord(buffer[position])',
+                  '    if not (%s):' % _condition(_intervals(self_labels)),
+                  '        break',
+                  '    position += 1']
+    if accept_id is not None:
+        lines.append('accepted, match_end = %r, position' % accept_id)
+
+    lines += ['if position >= end:',
+              '    if not final:',
+              '        return None']
+    if eof_destination is not None:
+        lines += ['    state = %d' % state_ids[eof_destination],
+                  '    position += 1',
+                  '    continue']
+    else:
+        lines.append('    return accepted, match_end')
+    if not by_destination:
+        lines.append('return accepted, match_end')
+        return lines
+    lines += ['c = ord(buffer[position])',
+              'position += 1']
+
+    keyword = 'if'
+    for destination, labels in sorted(by_destination.iteritems(),
+                                      key=lambda item: state_ids[item[0]]):
+        lines += ['%s %s:' % (keyword, _condition(_intervals(labels))),
+                  '    state = %d' % state_ids[destination]]
+        keyword = 'elif'
+    lines += ['else:', '    return accepted, match_end']
+    return lines
+
+
+def _dispatch_lines(bodies, low, high):
+    """Return the lines that run the body of the current state.
+
+    The state is known to be from low up to (not including) high.
+    """
+    if high - low == 1:
+        return bodies[low]
+    middle = (low + high) // 2
+    lines = ['if state < %d:' % middle]
+    lines += ['    ' + line for line in _dispatch_lines(bodies, low, middle)]
+    lines.append('else:')
+    lines += ['    ' + line for line in _dispatch_lines(bodies, middle, high)]
+    return lines
+
+
+def _match_source(automaton, accept_id):
+    """Return the source of longest_match_at for a dfa.Dfa.
+
+    accept_id maps each accepting state to the id it reports.
+    """
+    states, state_ids = graph.numbered(automaton.start)
+    bodies = [_state_lines(state, state_ids, accept_id(state)
+                           if state in automaton.accepting_states else None)
+              for state in states]
+    indent = ' ' * 8
+    return _MATCH_TEMPLATE % '\n'.join(
+        indent + line for line in _dispatch_lines(bodies, 0, len(states)))
+
+
+def dfa_source(automaton, acceptors):
+    """Generate a module that runs a dfa.Dfa.
+
+    The module's longest_match_at and match functions report accept ids,
+    which index its ACCEPTS list.  Each entry of ACCEPTS is a tuple of
+    the indexes in acceptors of a state's accepting NFA states.
+
+    Args:
+        automaton: A dfa.Dfa.
+        acceptors: A list of the NFA's accepting states.
+    """
+    acceptor_ids = dict((acceptor, i) for i, acceptor in enumerate(acceptors))
+    accept_ids = {}
+    accepts = []
+    def accept_id(state):
+        key = tuple(sorted(acceptor_ids[acceptor] for acceptor in state.accepts))
+        if key not in accept_ids:
+            accept_ids[key] = len(accepts)
+            accepts.append(key)
+        return accept_ids[key]
+    match_source = _match_source(automaton, accept_id)
+    return ''.join([_HEADER, '\nACCEPTS = %r\n' % accepts,
+                    match_source, _DFA_TEMPLATE])
+
+
+def lexer_source(lex):
+    """Generate a module that lexes like a lexer.Lexer.
+
+    The module's RULES lists a (name, emitted) pair for each rule.  Its
+    lex function yields a (type name, value) pair for each emitted token,
+    and its spans function yields a (rule index, start, end) tuple for
+    every token.
+    """
+    if lex.engine != 'dfa':
+        lex = lexer.Lexer(lex.rules, 'dfa')
+    rule_ids = dict((rule, i) for i, rule in enumerate(lex.rules))
+    rule_ids[lex._eof_rule] = -1
+    match_source = _match_source(
+        lex.matcher, lambda state: rule_ids[lex._rule(state.accepts)])
+    rules = [(rule.name, rule.emitted) for rule in lex.rules]
+    return ''.join([_HEADER, '\nEOF = -1\nRULES = %r\n' % rules,
+                    match_source, _LEXER_TEMPLATE])
+
+
+def load(source, name='generated'):
+    """Run generated source as a new module, and return the module."""
+    module = imp.new_module(name)
+    exec compile(source, '<%s>' % name, 'exec') in module.__dict__
+    return module
+
+
+def cached_module(source, directory):
+    """Import generated source, saving it to a directory first.
+
+    Modules are saved under a hash of their source, so each is written
+    once and then imported (and byte-compiled) from disk.
+    """
+    name = 'pylexparse_%s' % hashlib.sha1(source).hexdigest()
+    path = os.path.join(directory, name + '.py')
+    if not os.path.exists(path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Write atomically, so concurrent importers never see half of it.
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as output:
+            output.write(source)
+        os.rename(output.name, path)
+    return imp.load_source(name, path)
@@ -0,0 +1,43 @@
+"""Unit tests for codegen."""
+import shutil
+import tempfile
+import unittest
+
+import codegen
+import finiteautomata
+import lexer
+import lexer_test
+import regex
+
+class TestCodegen(unittest.TestCase):
+    def test_dfa(self):
+        nfa = regex.parse_regex('[bm]e*(at|f{4})').compiled()
+        automaton = finiteautomata.minimize(finiteautomata.nfa_to_dfa(nfa))
+        module = codegen.load(codegen.dfa_source(automaton, list(nfa.accepting)))
+        self.assertEqual([(0,)], module.ACCEPTS)
+        self.assertEqual(0, module.match('beeeffff'))
+        self.assertEqual(None, module.match('beef'))
+        self.assertEqual((0, 4), module.longest_match_at('meatball', 0))
+        self.assertEqual(None, module.longest_match_at('mea', 0, final=False))
+
+    def test_lexer(self):
+        lex_ = lexer.Lexer(lexer_test.RULES)
+        module = codegen.load(codegen.lexer_source(lex_))
+        text = 'x if 12 iffy'
+        self.assertEqual([tuple(token) for token in lex_.lex(text)],
+                         list(module.lex(text)))
+        self.assertRaises(ValueError, list, module.lex('x ?'))
+
+    def test_cached_module(self):
+        source = codegen.lexer_source(lexer.Lexer(lexer_test.RULES))
+        directory = tempfile.mkdtemp()
+        try:
+            module = codegen.cached_module(source, directory)
+            self.assertEqual([('IF', 'if')], list(module.lex('if')))
+            again = codegen.cached_module(source, directory)
+            self.assertEqual(module.__file__, again.__file__)
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
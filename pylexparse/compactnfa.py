@@ -0,0 +1,186 @@
+"""A compact, integer-indexed form of a frozen NFA."""
+
+import charsource
+import graph
+
+
+class CompactNfa(object):
+    """An NFA whose states are numbered, and whose state sets are bitsets.
+
+    States are numbered 0..N-1.  A set of states is a Python int, whose
+    i-th bit is set iff state i is in the set.  For each character
+    class, the NFA keeps a bitset of the states with transitions along
+    it, and each such state's bitset of destinations, already
+    epsilon-closed.  So, advancing is a handful of integer operations
+    per active state.
+    """
+
+    def __init__(self, start, accepting, sources, destinations, acceptors,
+                 classes, nfa):
+        """Args:
+            start: The bitset of states before reading any input.
+            accepting: The bitset of accepting states.
+            sources: A dict mapping each character class to the bitset of
+                states with transitions along it.
+            destinations: A dict mapping each character class to a dict
+                from state number to the bitset of its destinations.
+            acceptors: A dict mapping the number of each accepting state
+                to the original NFA state it stands for.
+            classes: The charclasses.CharClasses of the transitions.
+            nfa: The frozen nfa.Nfa this was compiled from.
+        """
+        self.start = start
+        self.accepting = accepting
+        self._sources = sources
+        self._destinations = destinations
+        self._acceptors = acceptors
+        self.classes = classes
+        self.nfa = nfa
+        # Maps accepting bitset -> frozenset of original NFA states.
+        self._accepted_states = {}
+
+    def accepted_states(self, bitset):
+        """Return the original NFA states for a bitset of accepting states."""
+        try:
+            return self._accepted_states[bitset]
+        except KeyError:
+            pass
+        states = []
+        remaining = bitset
+        while remaining:
+            lowest = remaining & -remaining
+            states.append(self._acceptors[lowest.bit_length() - 1])
+            remaining ^= lowest
+        result = self._accepted_states[bitset] = frozenset(states)
+        return result
+
+    def advance(self, active, char):
+        """Return the bitset of states reached from active along char."""
+        char_class = self.classes.classify(char)
+        relevant = active & self._sources.get(char_class, 0)
+        if not relevant:
+            return 0
+        destinations = self._destinations[char_class]
+        next_active = 0
+        while relevant:
+            lowest = relevant & -relevant
+            next_active |= destinations[lowest.bit_length() - 1]
+            relevant ^= lowest
+        return next_active
+
+    def match(self, candidate):
+        """Match the candidate against this NFA.
+
+        Return the accepting NFA states of the match.
+        """
+        return charsource.full_match(self, candidate)
+
+    def longest_match(self, source):
+        """Find the longest match, starting from the first character.
+
+        Args:
+            source: A RewindSource of characters.
+        Return (accepting NFA states, matching string) tuple.
+        """
+        accepting = self.accepting
+        sources = self._sources
+        all_destinations = self._destinations
+        classify = self.classes.classify
+
+        active = self.start
+        match = 0, 0
+
+        for i, char in enumerate(source):
+            if not active:
+                break
+            accepted = active & accepting
+            if accepted:
+                match = accepted, i
+            # This is advance(), inlined.
+            char_class = classify(char)
+            relevant = active & sources.get(char_class, 0)
+            active = 0
+            if relevant:
+                destinations = all_destinations[char_class]
+                while relevant:
+                    lowest = relevant & -relevant
+                    active |= destinations[lowest.bit_length() - 1]
+                    relevant ^= lowest
+
+        accepted, match_length = match
+        matching_string = source.disown_first(match_length)
+        source.rewind()
+        return self.accepted_states(accepted), matching_string
+
+    def longest_match_at(self, buffer, position, final=True,
+                         progress=None):
+        """Find the longest match in a buffer, starting at a position.
+
+        See nfa.Nfa.longest_match_at.
+        """
+        accepting = self.accepting
+        sources = self._sources
+        all_destinations = self._destinations
+        classify = self.classes.classify
+        end = len(buffer)
+
+        active = self.start
+        match = 0, position
+        if progress is not None:
+            active, match = progress.resumed(active, match, position)
+
+        while active:
+            accepted = active & accepting
+            if accepted:
+                match = accepted, position
+            if position < end:
+                char = buffer[position]
+            elif final:
+                char = None
+            else:
+                if progress is not None:
+                    progress.save(active, match, end)
+                return None
+            # This is advance(), inlined.
+            char_class = classify(char)
+            relevant = active & sources.get(char_class, 0)
+            active = 0
+            if relevant:
+                destinations = all_destinations[char_class]
+                while relevant:
+                    lowest = relevant & -relevant
+                    active |= destinations[lowest.bit_length() - 1]
+                    relevant ^= lowest
+            position += 1
+
+        accepted, match_end = match
+        return self.accepted_states(accepted), match_end
+
+
+def compact(nfa):
+    """Compile a frozen nfa.Nfa into a CompactNfa."""
+    assert nfa.frozen, 'Only frozen NFAs can be compacted.'
+    states = list(graph.reachable(nfa.start))
+    bits = dict((state, 1 << i) for i, state in enumerate(states))
+
+    def bitset(state_set):
+        result = 0
+        for state in state_set:
+            result |= bits[state]
+        return result
+
+    sources = {}
+    destinations = {}
+    # Many transitions share a closure, so share the converted bitsets, too.
+    bitsets = {}
+    for state_id, state in enumerate(states):
+        for char_class, closure in state.closed_transitions.iteritems():
+            if closure not in bitsets:
+                bitsets[closure] = bitset(closure)
+            sources[char_class] = sources.get(char_class, 0) | bits[state]
+            destinations.setdefault(char_class, {})[state_id] = bitsets[closure]
+
+    acceptors = dict((i, state) for i, state in enumerate(states)
+                     if state in nfa.accepting)
+    return CompactNfa(bitset(nfa.start_states()), bitset(acceptors.values()),
+                      sources, destinations, acceptors, nfa.classes, nfa)
@@ -1,23 +1,132 @@
-import collections
+"""DFA datatypes, and tools to run them."""
+
+import bisect
+
+import charsource
+
 
 class State(object):
+    """A state of a Deterministic Finite Automaton.
+
+    Each character leads to at most one destination state.
+    """
+
     def __init__(self):
-        self._transitions = collections.defaultdict(set)
+        self._transitions = {}
+        # Disjoint (low, high, destination) range transitions, sorted by
+        # low, and the lows' code points alone, for bisecting.
+        self._ranges = []
+        self._range_lows = []
+        # The accepting NFA states this DFA state stands for, if any.
+        self.accepts = frozenset()
 
-    def add_transition(self, character, destination):
-        assert character not in self._transitions, (
-            'Cannot re-add transition for character %s' % character)
-        self._transitions[character] = destination
+    def add_transition(self, label, destination):
+        """Add a transition along a character, or a (low, high) range tuple."""
+        if isinstance(label, tuple):
+            low, high = label
+            i = bisect.bisect_left(self._range_lows, ord(low))
+            self._range_lows.insert(i, ord(low))
+            self._ranges.insert(i, (low, high, destination))
+            return
+        assert label not in self._transitions, (
+            'Cannot re-add transition for character %s' % label)
+        self._transitions[label] = destination
 
     def __iter__(self):
-        return self._transitions.iteritems()
+        for item in self._transitions.iteritems():
+            yield item
+        for low, high, destination in self._ranges:
+            yield (low, high), destination
 
     def successors(self):
-        return self._transitions.values()
+        return self._transitions.values() + [
+            destination for unused_low, unused_high, destination in self._ranges]
+
+    def follow(self, character):
+        """Return the destination along a character, or None if there is none."""
+        destination = self._transitions.get(character)
+        if destination is None and self._ranges and character is not None:
+            # Compare code points, since str and unicode don't compare
+            # sensibly outside of ASCII.
+            code = ord(character)
+            i = bisect.bisect_right(self._range_lows, code) - 1
+            if i >= 0:
+                unused_low, high, candidate = self._ranges[i]
+                if code <= ord(high):
+                    return candidate
+        return destination
 
 
 class Dfa(object):
+    """A Deterministic Finite Automaton.
+
+    As with nfa.Nfa, the structure is given by the States reachable from
+    the start state.
+    """
+
     def __init__(self, start, accepting_states):
         self.start = start
         self.accepting_states = set(accepting_states)
 
+    def match(self, candidate):
+        """Match the candidate against this DFA.
+
+        Return the accepting NFA states of the match.
+        """
+        return charsource.full_match(self, candidate)
+
+    def longest_match(self, source):
+        """Find the longest match, starting from the first character.
+
+        Follows exactly one state per character.
+
+        Args:
+            source: A RewindSource of characters.
+        Return (accepting NFA states, matching string) tuple.
+        """
+        state = self.start
+        accepting_states = self.accepting_states
+
+        match = frozenset(), 0
+
+        for i, char in enumerate(source):
+            if state is None:
+                break
+            if state in accepting_states:
+                match = state.accepts, i
+            state = state.follow(char)
+
+        matching_states, match_length = match
+        matching_string = source.disown_first(match_length)
+        source.rewind()
+        return matching_states, matching_string
+
+    def longest_match_at(self, buffer, position, final=True,
+                         progress=None):
+        """Find the longest match in a buffer, starting at a position.
+
+        See nfa.Nfa.longest_match_at.
+        """
+        state = self.start
+        accepting_states = self.accepting_states
+        end = len(buffer)
+
+        match = frozenset(), position
+        if progress is not None:
+            state, match = progress.resumed(state, match, position)
+
+        while state is not None:
+            if state in accepting_states:
+                match = state.accepts, position
+            if position < end:
+                char = buffer[position]
+            elif final:
+                char = None
+            else:
+                if progress is not None:
+                    progress.save(state, match, end)
+                return None
+            state = state.follow(char)
+            position += 1
+
+        return match
@@ -1,15 +1,34 @@
 import collections
 import sets
 
+import charclasses
+import compactnfa
 import dfa
+import graph
+import lazydfa
+import flatdfa
 import nfa as nfas
 
+# The kinds of automaton that build_matcher can run an NFA as.
+ENGINES = ('nfa', 'dfa', 'table', 'lazy', 'compact')
+
 
 class NfaStateSet(sets.ImmutableSet):
     """An immutable set of NFA states."""
 
-    
+
 def nfa_to_dfa(nfa):
+    """Build a DFA from an NFA by subset construction.
+
+    Transitions are computed per character class, not per character, and
+    each DFA transition is labeled with the fewest ranges that cover its
+    classes.
+    """
+    classes = nfa.classes
+    if classes is None:
+        classes = charclasses.CharClasses.from_labels(
+            label for state in graph.reachable(nfa.start)
+            for label, unused_destination in state)
 
     # Maps NfaStateSet -> dfa.State.
     dfa_states = collections.defaultdict(dfa.State)
@@ -19,26 +38,190 @@ def nfa_to_dfa(nfa):
     done = set()
     start_nss = NfaStateSet(nfas.epsilon_closure(nfa.start))
     worklist.append(start_nss)
+    dfa_start = dfa_states[start_nss]
 
     while worklist:
         focus = worklist.pop()
         if focus in done:
             continue
         done.add(focus)
-            
+
+        # Maps character class -> NFA destinations.
         dfa_transitions = collections.defaultdict(set)
         for nfa_state in focus:
-            for char, nfa_dest in nfa_state:
-                if not char:
+            for label, nfa_dest in nfa_state:
+                if label == '':
                     # Empty transitions are dealt with separately (by finding epsilon closures).
                     continue
-                dfa_transitions[char].add(nfa_dest)
+                for char_class in classes.classes_of(label):
+                    dfa_transitions[char_class].add(nfa_dest)
 
-        for char, next_states in dfa_transitions.iteritems():
-            next_set = NfaStateSet(nfas.multi_epsilon_closure(next_states))
+        # Maps NfaStateSet -> the classes leading to it.
+        next_sets = collections.defaultdict(list)
+        closures = {}
+        for char_class, next_states in dfa_transitions.iteritems():
+            next_states = frozenset(next_states)
+            if next_states not in closures:
+                closures[next_states] = NfaStateSet(
+                    nfas.multi_epsilon_closure(next_states))
+            next_sets[closures[next_states]].append(char_class)
+
+        for next_set, char_classes in next_sets.iteritems():
             worklist.append(next_set)
-            dfa_states[focus].add_transition(char, dfa_states[next_set])
-    
-    accepting_states = set(dfa_state for nss, dfa_state in dfa_states.iteritems() if nfa.accepting.intersection(nss))
+            for label in classes.labels(char_classes):
+                dfa_states[focus].add_transition(label, dfa_states[next_set])
+
+    accepting_states = set()
+    for nss, dfa_state in dfa_states.iteritems():
+        acceptors = nfa.accepting.intersection(nss)
+        if acceptors:
+            dfa_state.accepts = frozenset(acceptors)
+            accepting_states.add(dfa_state)
+
+    return dfa.Dfa(dfa_start, accepting_states)
+
+
+def minimize(dfa_to_minimize, key=None, counts=None):
+    """Merge equivalent states of a DFA, using Hopcroft's algorithm.
+
+    Two states are only ever merged if key() agrees on them.  By
+    default, the key is the set of accepting NFA states a DFA state
+    stands for, so acceptors of different lexer rules stay distinct.
+
+    If counts is a collections.Counter, the refinement work is added to
+    it: 'splitter_states' counts the states of every splitter taken off
+    the worklist, and 'splits' counts the blocks split.  Hopcroft's
+    algorithm keeps the former within n log n for n states.
+
+    Return a new, minimal dfa.Dfa.
+    """
+    if key is None:
+        key = lambda state: state.accepts
+
+    reachable = list(graph.reachable(dfa_to_minimize.start))
+    # The DFA's transitions are partial.  Missing transitions lead to an
+    # implicit dead state, which is never put in the partition, and
+    # neither are the states that can't reach acceptance, since they're
+    # equivalent to it.  Every state treats the characters of a class
+    # alike, so one character per class will do.
+    classes = charclasses.CharClasses.from_labels(
+        label for state in reachable for label, unused_destination in state)
+    alphabet = [classes.representative(char_class)
+                for char_class in range(classes.num_classes)]
+
+    # Maps char -> destination -> set of sources.
+    predecessors = collections.defaultdict(
+        lambda: collections.defaultdict(set))
+    for char in alphabet:
+        char_predecessors = predecessors[char]
+        for state in reachable:
+            destination = state.follow(char)
+            if destination is not None:
+                char_predecessors[destination].add(state)
+
+    live = set(dfa_to_minimize.accepting_states)
+    worklist = list(live)
+    while worklist:
+        destination = worklist.pop()
+        for char in alphabet:
+            for source in predecessors[char].get(destination, ()):
+                if source not in live:
+                    live.add(source)
+                    worklist.append(source)
+
+    # The initial partition groups live states by key.
+    initial_blocks = collections.defaultdict(set)
+    for state in live:
+        if state in dfa_to_minimize.accepting_states:
+            initial_blocks[key(state)].add(state)
+        else:
+            initial_blocks[None].add(state)
+    blocks = initial_blocks.values()
+    block_of = {}
+    for block_id, block in enumerate(blocks):
+        for state in block:
+            block_of[state] = block_id
+
+    # With the dead state left out, every initial block must be a
+    # splitter, since the others don't add up to the complement of any
+    # one of them.
+    worklist = set(range(len(blocks)))
+    while worklist:
+        splitter = list(blocks[worklist.pop()])
+        if counts is not None:
+            counts['splitter_states'] += len(splitter)
+        for char in alphabet:
+            char_predecessors = predecessors[char]
+            # Group the predecessors of the splitter by their blocks.
+            # Predecessors of live states are live themselves.
+            touched = collections.defaultdict(set)
+            for destination in splitter:
+                for source in char_predecessors.get(destination, ()):
+                    touched[block_of[source]].add(source)
+
+            for block_id, inside in touched.iteritems():
+                block = blocks[block_id]
+                if len(inside) == len(block):
+                    continue
+                # Keep the larger half in place; the smaller half moves.
+                # Only the smaller half is ever copied, to keep splitting
+                # proportional to it.
+                if 2 * len(inside) <= len(block):
+                    block -= inside
+                    moved = inside
+                else:
+                    moved = block - inside
+                    blocks[block_id] = inside
+                new_block_id = len(blocks)
+                blocks.append(moved)
+                if counts is not None:
+                    counts['splits'] += 1
+                for state in moved:
+                    block_of[state] = new_block_id
+                # Hopcroft's rule: if the old block is already waiting,
+                # both halves must be; otherwise, splitting by the smaller
+                # half suffices.  Either way, that's the half that moved.
+                worklist.add(new_block_id)
+
+    # Build one new state per block.
+    new_states = [dfa.State() for unused_block in blocks]
+    accepting_states = set()
+    for block_id, new_state in enumerate(new_states):
+        block = blocks[block_id]
+        representative = next(iter(block))
+        for char, destination in representative:
+            if destination in block_of:
+                new_state.add_transition(
+                    char, new_states[block_of[destination]])
+        if representative in dfa_to_minimize.accepting_states:
+            new_state.accepts = frozenset().union(
+                *(state.accepts for state in block))
+            accepting_states.add(new_state)
+
+    if dfa_to_minimize.start not in block_of:
+        # Nothing is accepted at all.  Keep a lone start state.
+        return dfa.Dfa(dfa.State(), [])
+    return dfa.Dfa(new_states[block_of[dfa_to_minimize.start]],
+                   accepting_states)
+
+
+def build_matcher(nfa, engine='nfa', key=None):
+    """Prepare an NFA to be run by the named engine.
 
-    return dfa.Dfa(dfa_states[start_nss], accepting_states)
+    Every engine's matcher has the same match() and longest_match()
+    interface as nfa.Nfa, and reports matches in terms of the NFA's
+    accepting states.  NFAs run directly or lazily are frozen first.
+    For the DFA engines, key is passed on to minimize.
+    """
+    if engine == 'nfa':
+        return nfa.freeze()
+    if engine == 'dfa':
+        return minimize(nfa_to_dfa(nfa), key)
+    if engine == 'table':
+        return flatdfa.flatten(minimize(nfa_to_dfa(nfa), key))
+    if engine == 'lazy':
+        return lazydfa.LazyDfa(nfa.freeze())
+    if engine == 'compact':
+        return compactnfa.compact(nfa.freeze())
+    raise ValueError('Unknown engine "%s". Expected one of: %s.' %
+                     (engine, ', '.join(ENGINES)))
@@ -0,0 +1,33 @@
+"""Unit tests for finiteautomata."""
+import collections
+import unittest
+
+import finiteautomata
+import flatdfa
+import pattern
+import regex
+
+class TestFiniteAutomata(unittest.TestCase):
+    def test_minimize(self):
+        nfa = regex.parse_regex('ab|cb').compiled()
+        unminimized = flatdfa.flatten(finiteautomata.nfa_to_dfa(nfa))
+        minimized = flatdfa.flatten(
+            finiteautomata.minimize(finiteautomata.nfa_to_dfa(nfa)))
+        self.assertEqual(5, unminimized.num_states)
+        self.assertEqual(3, minimized.num_states)
+        self.assertTrue(minimized.match('cb'))
+        self.assertFalse(minimized.match('ac'))
+
+    def test_minimize_scales(self):
+        # A literal's DFA is a chain, which is split one state at a time.
+        # Splitting by the smaller halves keeps the work linear; splitting
+        # by the larger ones would make it quadratic.
+        long_ = pattern.String('x' * 8000).compiled()
+        counts = collections.Counter()
+        finiteautomata.minimize(finiteautomata.nfa_to_dfa(long_), counts=counts)
+        self.assertEqual(7999, counts['splits'])
+        self.assertTrue(counts['splitter_states'] <= 2 * 8001)
+        self.assertTrue(finiteautomata.build_matcher(long_, 'table').match('x' * 8000))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""A compact, table-driven form of a DFA."""
+
+import array
+
+import charclasses
+import charsource
+import graph
+
+# The destination of transitions that lead nowhere.
+DEAD = -1
+# The class of characters that no state has a transition for.
+_NO_TRANSITIONS_CLASS = 0
+
+
+class FlatDfa(object):
+    """A DFA whose transitions live in a single array of integers.
+
+    States are numbered 0..N-1, and the start state is 0.  Characters are
+    first mapped to equivalence classes: two characters share a class iff
+    every state treats them identically.  The table has one row per state
+    and one column per class, so the destination of state s along a
+    character in class c is table[s * num_classes + c].
+
+    Characters are classified by bisecting the boundaries of the DFA's
+    ranges, and each character's class is cached, so a class covering
+    all of Unicode costs no more than one covering a single character.
+    """
+
+    def __init__(self, table, num_classes, accepts, char_classes, columns):
+        """Args:
+            table: An array of destination state numbers, or DEAD.
+            num_classes: The number of columns in the table.
+            accepts: A list with the accepting NFA states of each DFA
+                state, or an empty frozenset for non-accepting states.
+            char_classes: The charclasses.CharClasses of the DFA's
+                transition labels.
+            columns: A list mapping each of char_classes' classes to its
+                column.  Characters in none of them have no transitions.
+        """
+        self.table = table
+        self.num_classes = num_classes
+        self.accepts = accepts
+        self.char_classes = char_classes
+        self.columns = columns
+        # Maps character -> column, for the characters seen so far.
+        self.classes = {}
+
+    @property
+    def num_states(self):
+        return len(self.accepts)
+
+    def classify(self, char):
+        """Return the column of a character (or the EOF)."""
+        try:
+            return self.classes[char]
+        except KeyError:
+            pass
+        char_class = self.char_classes.classify(char)
+        if char_class == charclasses.NO_CLASS:
+            column = _NO_TRANSITIONS_CLASS
+        else:
+            column = self.columns[char_class]
+        self.classes[char] = column
+        return column
+
+    def next_state(self, state, char):
+        """Return the state after a state along a character, or DEAD."""
+        return self.table[state * self.num_classes + self.classify(char)]
+
+    def match(self, candidate):
+        """Match the candidate against this DFA.
+
+        Return the accepting NFA states of the match.
+        """
+        return charsource.full_match(self, candidate)
+
+    def longest_match(self, source):
+        """Find the longest match, starting from the first character.
+
+        Args:
+            source: A RewindSource of characters.
+        Return (accepting NFA states, matching string) tuple.
+        """
+        table = self.table
+        classes = self.classes
+        classify = self.classify
+        num_classes = self.num_classes
+        accepts = self.accepts
+
+        state = 0
+        match = frozenset(), 0
+
+        for i, char in enumerate(source):
+            if state == DEAD:
+                break
+            if accepts[state]:
+                match = accepts[state], i
+            column = classes.get(char)
+            if column is None:
+                column = classify(char)
+            state = table[state * num_classes + column]
+
+        matching_states, match_length = match
+        matching_string = source.disown_first(match_length)
+        source.rewind()
+        return matching_states, matching_string
+
+    def longest_match_at(self, buffer, position, final=True,
+                         progress=None):
+        """Find the longest match in a buffer, starting at a position.
+
+        See nfa.Nfa.longest_match_at.
+        """
+        table = self.table
+        classes = self.classes
+        classify = self.classify
+        num_classes = self.num_classes
+        accepts = self.accepts
+        end = len(buffer)
+
+        state = 0
+        match = frozenset(), position
+        if progress is not None:
+            state, match = progress.resumed(state, match, position)
+
+        while state != DEAD:
+            if accepts[state]:
+                match = accepts[state], position
+            if position < end:
+                char = buffer[position]
+            elif final:
+                char = None
+            else:
+                if progress is not None:
+                    progress.save(state, match, end)
+                return None
+            column = classes.get(char)
+            if column is None:
+                column = classify(char)
+            state = table[state * num_classes + column]
+            position += 1
+
+        return match
+
+
+def flatten(dfa):
+    """Compile a dfa.Dfa into a FlatDfa."""
+    states, state_ids = graph.numbered(dfa.start)
+
+    char_classes = charclasses.CharClasses.from_labels(
+        label for state in states for label, unused_destination in state)
+
+    # Each character class's column: its destination from every state.
+    # Classes with identical columns share one.
+    class_ids = {tuple([DEAD] * len(states)): _NO_TRANSITIONS_CLASS}
+    class_columns = [[DEAD] * len(states)]
+    columns = []
+    for char_class in range(char_classes.num_classes):
+        char = char_classes.representative(char_class)
+        column = []
+        for state in states:
+            destination = state.follow(char)
+            column.append(DEAD if destination is None else state_ids[destination])
+        key = tuple(column)
+        if key not in class_ids:
+            class_ids[key] = len(class_columns)
+            class_columns.append(column)
+        columns.append(class_ids[key])
+
+    num_classes = len(class_columns)
+    table = array.array('i', [DEAD] * (len(states) * num_classes))
+    for class_id, column in enumerate(class_columns):
+        for state_id, destination in enumerate(column):
+            table[state_id * num_classes + class_id] = destination
+
+    accepts = [state.accepts if state in dfa.accepting_states else frozenset()
+               for state in states]
+    return FlatDfa(table, num_classes, accepts, char_classes, columns)
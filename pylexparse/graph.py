@@ -6,6 +6,16 @@ def reachable(start_node):
     """Yields each node reachable from a start node exactly once."""
     return dfs(start_node)
 
+def numbered(start_node):
+    """Number the nodes reachable from a start node.
+
+    Returns a list of the nodes, and a dict mapping each node to its
+    index in the list.  The start node is always number 0.
+    """
+    # The DFS yields the start node first.
+    nodes = list(dfs(start_node))
+    return nodes, dict((node, i) for i, node in enumerate(nodes))
+
 def dfs(start_node):
     """Yields each node reachable from a start node exactly once, using DFS."""
     agenda = collections.deque()
@@ -19,6 +19,12 @@ class Registrar(object):
             self._ids[obj] = new_id
             return new_id
 
+def _edge_label(edge_name):
+    """Show range transitions as 'low-high'."""
+    if isinstance(edge_name, tuple):
+        return '%s-%s' % edge_name
+    return edge_name
+
 def as_dot(graph):
     output = cStringIO.StringIO()
     print >>output, 'digraph unnamed{'
@@ -33,13 +39,13 @@ def as_dot(graph):
     for node in graphutil.reachable(graph.start):
         print >>output, '%d [shape="%s"]' % (
             registrar.get_id(node),
-            'doublecircle' if node in graph.accepting_states else 'circle',
+            'doublecircle' if node in graph.accepting else 'circle',
             )
         for edge_name, successor in node:
             print >>output, '%d -> %d [label="%s"]' % (
                 registrar.get_id(node),
                 registrar.get_id(successor),
-                edge_name)
+                _edge_label(edge_name))
 
     print >>output, '}'
 
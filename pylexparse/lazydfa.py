@@ -0,0 +1,203 @@
+"""A DFA that is built from an NFA on demand, as input reaches it."""
+
+import charsource
+import nfa as nfas
+
+# The default number of DFA states a LazyDfa may cache.
+DEFAULT_MAX_STATES = 10000
+
+
+class _LazyState(object):
+    """A DFA state, standing for a set of NFA states."""
+
+    __slots__ = ('nfa_states', 'accepts', 'transitions')
+
+    def __init__(self, nfa_states, accepts):
+        self.nfa_states = nfa_states
+        self.accepts = accepts
+        # Maps character class -> _LazyState, for the classes seen so far.
+        self.transitions = {}
+
+
+class LazyDfa(object):
+    """Runs an NFA as a DFA, without building the DFA up front.
+
+    Each DFA state is built by subset construction the first time the
+    input reaches it, and cached along with the transition that led
+    to it.  At most max_states states are cached.  When the cache is
+    full, it is flushed, and states are rebuilt as they are reached
+    again.  Transitions are cached per character class of the frozen
+    NFA, rather than per character, so typical input runs at DFA speed,
+    and pathological patterns cost no more memory than max_states DFA
+    states with a transition per class each.
+    """
+
+    def __init__(self, nfa, max_states=DEFAULT_MAX_STATES, unanchored=False):
+        """Args:
+            nfa: The frozen NFA to run.
+            max_states: The most DFA states to cache at once.
+            unanchored: Whether to restart the NFA at every character, as
+                though the NFA were prefixed with '.*'.  An unanchored
+                DFA's states contain the NFA states of matches starting
+                anywhere.
+        """
+        assert nfa.frozen, 'Only frozen NFAs can be run lazily.'
+        self.nfa = nfa
+        self._classify = nfa.classes.classify
+        self.max_states = max_states
+        self.unanchored = unanchored
+        # The number of times the cache has been flushed.
+        self.flushes = 0
+        self._dead = _LazyState(frozenset(), frozenset())
+        # Maps frozenset of NFA states -> _LazyState.
+        self._states = {}
+        self._start = self._intern(nfa.start_states())
+
+    @property
+    def num_states(self):
+        """The number of DFA states currently cached."""
+        return len(self._states)
+
+    @property
+    def start(self):
+        """The DFA state before reading any input."""
+        return self._start
+
+    def next_state(self, state, char):
+        """Return the DFA state after a state along a character.
+
+        Return None if no NFA state survives the character.
+        """
+        char_class = self._classify(char)
+        next_state = state.transitions.get(char_class)
+        if next_state is None:
+            next_state = self._step(state, char_class)
+        return None if next_state is self._dead else next_state
+
+    def _intern(self, nfa_states):
+        """Get the cached DFA state for a set of NFA states, or build it."""
+        try:
+            return self._states[nfa_states]
+        except KeyError:
+            pass
+        if len(self._states) >= self.max_states:
+            self._flush()
+        state = _LazyState(nfa_states, nfa_states & self.nfa.accepting)
+        self._states[nfa_states] = state
+        return state
+
+    def _flush(self):
+        """Forget every cached state, except the start state."""
+        self.flushes += 1
+        for state in self._states.itervalues():
+            state.transitions.clear()
+        self._states.clear()
+        self._states[self._start.nfa_states] = self._start
+
+    def _step(self, state, char_class):
+        """Build and cache the transition from a state along a character class."""
+        next_nfa_states = nfas.advance_frozen(state.nfa_states, char_class)
+        if self.unanchored:
+            next_nfa_states |= self._start.nfa_states
+        next_nfa_states = frozenset(next_nfa_states)
+        if next_nfa_states:
+            next_state = self._intern(next_nfa_states)
+        else:
+            next_state = self._dead
+        state.transitions[char_class] = next_state
+        return next_state
+
+    def match(self, candidate):
+        """Match the candidate against this DFA.
+
+        Return the accepting NFA states of the match.
+        """
+        return charsource.full_match(self, candidate)
+
+    def longest_match(self, source):
+        """Find the longest match, starting from the first character.
+
+        Args:
+            source: A RewindSource of characters.
+        Return (accepting NFA states, matching string) tuple.
+        """
+        dead = self._dead
+        classify = self._classify
+        state = self._start
+        match = frozenset(), 0
+
+        for i, char in enumerate(source):
+            if state is dead:
+                break
+            if state.accepts:
+                match = state.accepts, i
+            char_class = classify(char)
+            next_state = state.transitions.get(char_class)
+            if next_state is None:
+                next_state = self._step(state, char_class)
+            state = next_state
+
+        matching_states, match_length = match
+        matching_string = source.disown_first(match_length)
+        source.rewind()
+        return matching_states, matching_string
+
+    def all_accepts(self, buffer):
+        """Return every accepting NFA state reached while reading a buffer.
+
+        For an unanchored DFA, these are the acceptors of every match
+        anywhere in the buffer.
+        """
+        dead = self._dead
+        classify = self._classify
+        state = self._start
+        found = set(state.accepts)
+        num_acceptors = len(self.nfa.accepting)
+
+        for char in buffer:
+            if state is dead or len(found) == num_acceptors:
+                break
+            char_class = classify(char)
+            next_state = state.transitions.get(char_class)
+            if next_state is None:
+                next_state = self._step(state, char_class)
+            state = next_state
+            if state.accepts:
+                found.update(state.accepts)
+
+        return found
+
+    def longest_match_at(self, buffer, position, final=True,
+                         progress=None):
+        """Find the longest match in a buffer, starting at a position.
+
+        See nfa.Nfa.longest_match_at.
+        """
+        dead = self._dead
+        classify = self._classify
+        state = self._start
+        end = len(buffer)
+
+        match = frozenset(), position
+        if progress is not None:
+            state, match = progress.resumed(state, match, position)
+
+        while state is not dead:
+            if state.accepts:
+                match = state.accepts, position
+            if position < end:
+                char = buffer[position]
+            elif final:
+                char = None
+            else:
+                if progress is not None:
+                    progress.save(state, match, end)
+                return None
+            char_class = classify(char)
+            next_state = state.transitions.get(char_class)
+            if next_state is None:
+                next_state = self._step(state, char_class)
+            state = next_state
+            position += 1
+
+        return match
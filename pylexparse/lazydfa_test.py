@@ -0,0 +1,29 @@
+"""Unit tests for lazydfa."""
+import unittest
+
+import lazydfa
+import pattern
+import regex
+
+class TestLazyDfa(unittest.TestCase):
+    def test_cache_is_bounded(self):
+        nfa = regex.parse_regex('(a|b)*a(a|b){8}').compiled()
+        lazy = lazydfa.LazyDfa(nfa, max_states=16)
+        self.assertTrue(lazy.match('ab' * 20 + 'abbbbbbbb'))
+        self.assertFalse(lazy.match('ab' * 20 + 'bbbbbbbbb'))
+        self.assertTrue(lazy.flushes > 0)
+        self.assertTrue(lazy.num_states <= 16)
+
+    def test_transitions_per_class(self):
+        # Many distinct characters in one class share one transition.
+        nfa = pattern.Sequence(pattern.Star(pattern.Range(u'\x00', u'\uffff')),
+                               pattern.String('a')).compiled()
+        lazy = lazydfa.LazyDfa(nfa, max_states=4)
+        text = u''.join(unichr(code) for code in range(0x100, 0x100 + 20000))
+        self.assertTrue(lazy.match(text + u'a'))
+        num_transitions = sum(len(state.transitions)
+                              for state in lazy._states.itervalues())
+        self.assertTrue(num_transitions <= lazy.num_states * nfa.classes.num_classes)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,14 @@
 import collections
+import mmap
+import multiprocessing
 
 import charsource
+import dfa
+import finiteautomata
+import flatdfa
 import nfa
 import regex
+import stats as statistics
 
 class Token(collections.namedtuple('Token', ['type_name', 'value'])):
     def __str__(self):
@@ -18,62 +24,448 @@ class Rule(object):
 
 
 class Lexer(object):
-    """A lexer for a list of token rules."""
-    def __init__(self, rules):
-        self._acceptor_rules = {}
-        self._acceptor_precedences = {}
+    """A lexer for a list of token rules.
+
+    The engine names the kind of automaton that matches tokens.  See
+    finiteautomata.build_matcher for the choices.
+    """
+    def __init__(self, rules, engine='nfa', stats=None):
+        """Args:
+            rules: The lexer's rules.  Later rules take precedence.
+            engine: The name of the engine that matches tokens.
+            stats: A stats.Stats to record statistics in, or None.
+        """
+        with statistics.timed(stats, 'parse'):
+            patterns = [regex.parse_regex(rule.regex).simplified()
+                        for rule in rules]
+
+        acceptors = []
         start, end = nfa.State(), nfa.State()
-        for i, rule in enumerate(rules):
-            fragment = regex.parse_regex(rule.regex)._fragment()
-            acceptor = fragment.end
-            self._acceptor_rules[acceptor] = rule
-            # Later rules get higher precedence.  This mimics
-            # reassignment in most languages: `x=1; x=2;` means `x==2`.
-            self._acceptor_precedences[acceptor] = i
-            start.add_empty_transition(fragment.start)
-            fragment.end.add_empty_transition(end)
+        with statistics.timed(stats, 'fragments'):
+            for pat in patterns:
+                fragment = pat._fragment()
+                acceptors.append(fragment.end)
+                start.add_empty_transition(fragment.start)
+                fragment.end.add_empty_transition(end)
 
         # Add final EOF transition.
-        # The regex for this rule is never used.
-        # TODO(jasonpr): Allow a token to exist independently of its regex?
-        eof_rule = Rule('EOF', '', emitted=False)
         eof_acceptor = nfa.State()
         # None is our EOF.
         start.add_transition(None, eof_acceptor)
-        self._acceptor_rules[eof_acceptor] = eof_rule
-        # The EOF's precedence shouldn't matter, as it should never
-        # conflict with anything.  If something *does* conflict with
-        # EOF, we'd want to know about it.  So, EOF has the lowest
-        # precedence.
-        self._acceptor_precedences[eof_acceptor] = -1
         eof_acceptor.add_empty_transition(end)
+        acceptors.append(eof_acceptor)
+
+        # DFA states only need to stay apart if their winning rules differ.
+        precedences = _precedences(acceptors)
+        winner = lambda state: max(precedences[acc] for acc in state.accepts)
+        with statistics.timed(stats, 'build_matcher'):
+            matcher = finiteautomata.build_matcher(
+                nfa.Nfa(start, acceptors), engine, key=winner)
+        self._assemble(rules, engine, matcher, acceptors, stats)
+
+    @classmethod
+    def from_matcher(cls, rules, engine, matcher, acceptors, stats=None):
+        """Make a lexer around an already-built matcher.
+
+        Args:
+            rules: The lexer's rules.
+            engine: The name of the engine that built the matcher.
+            matcher: An automaton, as built by finiteautomata.build_matcher.
+            acceptors: The matcher's accepting NFA states.  The i-th
+                acceptor accepts the i-th rule, and the final acceptor
+                accepts the EOF.
+            stats: A stats.Stats to record statistics in, or None.
+        """
+        lexer = cls.__new__(cls)
+        lexer._assemble(rules, engine, matcher, acceptors, stats)
+        return lexer
 
-        self._nfa = nfa.Nfa(start, self._acceptor_rules.keys())
+    def _assemble(self, rules, engine, matcher, acceptors, stats):
+        assert len(acceptors) == len(rules) + 1
+        self.rules = list(rules)
+        self.engine = engine
+        self.acceptors = list(acceptors)
+        self._matcher = matcher
+        self.stats = stats
+        if stats is not None:
+            # Shadow the plain methods, so lexers without stats never
+            # check for them.
+            self._iterated_tokens = self._counted_iterated_tokens
+            self._token_at = self._counted_token_at
+
+        self._acceptor_rules = dict(zip(acceptors, rules))
+        self._acceptor_precedences = _precedences(acceptors)
+
+        # The regex for this rule is never used.
+        # TODO(jasonpr): Allow a token to exist independently of its regex?
+        eof_rule = Rule('EOF', '', emitted=False)
+        self._acceptor_rules[acceptors[-1]] = eof_rule
         self._eof_rule = eof_rule
 
+        # Maps frozenset of acceptors -> the winning rule.  Filled in up
+        # front for the accepting states of DFAs, and as they are met for
+        # the other engines.
+        self._winners = {}
+        for accepts in _accept_sets(matcher):
+            self._rule(accepts)
+
+    @property
+    def matcher(self):
+        """The automaton that matches tokens."""
+        return self._matcher
+
+    def _rule(self, acceptors):
+        """Return the rule of the highest-precedence acceptor."""
+        try:
+            return self._winners[acceptors]
+        except KeyError:
+            pass
+        # If there are multiple possibilities, choose the one with
+        # highest precedence.
+        acceptor = max(acceptors, key=lambda acc: self._acceptor_precedences[acc])
+        rule = self._winners[acceptors] = self._acceptor_rules[acceptor]
+        return rule
+
     def lex(self, input_str):
         """Break an input stream into tokens.
 
         Yields tokens from the input stream, for each token whose rule specifies
-        emitted=True.
+        emitted=True.  Buffers (see charsource.is_buffer) are read by
+        position, and token values are slices of them.
         """
-        source = charsource.RewindSource(input_str)
-        while True:
-            acceptors, match = self._nfa.longest_match(source)
+        if charsource.is_buffer(input_str):
+            for rule, start, end in self.spans(input_str):
+                if rule.emitted:
+                    yield Token(rule.name, input_str[start:end])
+            return
+
+        for rule, match in self._iterated_tokens(input_str):
+            if rule.emitted:
+                yield Token(rule.name, match)
 
-            # If there are multiple possibilities, choose the one with
-            # highest precedence.
-            acceptor = max(acceptors, key=lambda acc: self._acceptor_precedences[acc])
-            token = self._acceptor_rules[acceptor]
+    def _iterated_tokens(self, iterable, source=None):
+        """Yield a (rule, matching string) pair for every token, emitted or not.
 
-            if token is self._eof_rule:
+        Reads the iterable through a RewindSource, or through the given
+        source for it.
+        """
+        if source is None:
+            source = charsource.RewindSource(iterable)
+        while True:
+            acceptors, match = self._matcher.longest_match(source)
+            rule = self._rule(acceptors)
+
+            if rule is self._eof_rule:
                 break
 
             assert len(match) > 0
-            if token.emitted:
-                yield Token(self._acceptor_rules[acceptor].name, match)
+            yield rule, match
+
+    def _counted_iterated_tokens(self, iterable):
+        """Like _iterated_tokens, but records statistics."""
+        source = statistics.CountingSource(iterable)
+        for rule, match in Lexer._iterated_tokens(self, iterable, source):
+            chars_read = source.take_chars_read()
+            self.stats.record_token(rule.name, len(match), chars_read)
+            self.stats.record_steps(self._matcher, chars_read)
+            yield rule, match
+
+    def stream(self):
+        """Return a StreamLexer, for input that arrives in chunks."""
+        return StreamLexer(self)
+
+    def spans(self, buffer, position=0):
+        """Break a buffer into tokens, by position.
+
+        Yields a (rule, start, end) tuple for every token, emitted or not,
+        from the position up to the end of the buffer.
+        """
+        while True:
+            token = self._token_at(buffer, position)
+            if token is None:
+                break
+            rule, end = token
+            yield rule, position, end
+            position = end
+
+    def _token_at(self, buffer, position):
+        """Return the (rule, end) of the token at a position, or None at EOF."""
+        acceptors, end = self._matcher.longest_match_at(buffer, position)
+        rule = self._rule(acceptors)
+
+        if rule is self._eof_rule:
+            return None
+
+        assert end > position
+        return rule, end
+
+    def _counted_token_at(self, buffer, position):
+        """Like _token_at, but records statistics."""
+        counting = statistics.CountingBuffer(buffer)
+        token = Lexer._token_at(self, counting, position)
+        if token is not None:
+            rule, end = token
+            self.stats.record_token(rule.name, end - position, counting.chars_read)
+            self.stats.record_steps(self._matcher, counting.chars_read)
+        return token
+
+    def lex_parallel(self, text, processes=None, chunk_size=1 << 20,
+                     split_at='\n', look_ahead=1 << 16):
+        """Break a large string into tokens, using several processes.
+
+        The text is split into chunks, each just after an occurrence of
+        split_at, where a token most likely starts.  Each chunk is lexed
+        speculatively in a process pool, as though a token started there.
+        Wherever the serial token boundaries disagree with a chunk's
+        speculation, they are recomputed serially until the two line up
+        again.  So, the tokens are always the same as from lex().
+
+        Each process is sent only its chunk and the look_ahead characters
+        after it.  A chunk's speculation ends at any token that needs to
+        see past them.
+
+        Args:
+            text: A str or unicode.
+            processes: The size of the process pool.  Defaults to the
+                number of CPUs.
+            chunk_size: The approximate number of characters per chunk.
+            split_at: A string after which to split the text, or None to
+                split at exactly every chunk_size characters.
+            look_ahead: How many characters past its chunk each process
+                may read to finish the chunk's last token.
+        """
+        chunks = _split_points(text, chunk_size, split_at)
+        if len(chunks) == 1 or processes == 1:
+            speculations = [[]] * len(chunks)
+        else:
+            windows = []
+            for start, stop in chunks:
+                window_end = min(stop + look_ahead, len(text))
+                windows.append((start, stop - start, text[start:window_end],
+                                window_end == len(text)))
+            pool = multiprocessing.Pool(
+                processes, _init_lex_worker, (self.rules, self.engine))
+            try:
+                speculations = pool.map(_lex_chunk, windows)
+            finally:
+                pool.close()
+                pool.join()
+
+        # Lexing has reached the position, serially.
+        position = 0
+        for (unused_start, stop), spans in zip(chunks, speculations):
+            speculated_starts = dict(
+                (span_start, i) for i, (_, span_start, _) in enumerate(spans))
+            while position < stop:
+                if position in speculated_starts:
+                    # The speculation agrees from here on.
+                    for rule_index, start, end in spans[
+                            speculated_starts[position]:]:
+                        rule = self.rules[rule_index]
+                        if rule.emitted:
+                            yield Token(rule.name, text[start:end])
+                        position = end
+                    # If the speculation failed partway, the serial lexing
+                    # below fails the same way.
+                    if position >= stop:
+                        break
+                rule, end = self._token_at(text, position)
+                if rule.emitted:
+                    yield Token(rule.name, text[position:end])
+                position = end
+
+    def lex_file(self, open_file, mapped=False, offsets=False):
+        """Break a file into tokens.
+
+        Args:
+            open_file: A file, opened for reading.
+            mapped: Whether to memory-map the file and lex it by position,
+                rather than reading it a line at a time.  The file must
+                be a real file, with a fileno().
+            offsets: Whether to yield a (type_name, start, end) tuple for
+                each emitted token, instead of a Token.  This avoids
+                copying token text out of the file.
+        """
+        if not mapped:
+            position = 0
+            for rule, match in self._iterated_tokens(
+                    charsource.chars_in_file(open_file)):
+                start, position = position, position + len(match)
+                if not rule.emitted:
+                    continue
+                if offsets:
+                    yield rule.name, start, position
+                else:
+                    yield Token(rule.name, match)
+            return
+
+        try:
+            buffer_ = mmap.mmap(open_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped.
+            buffer_ = ''
+        try:
+            for rule, start, end in self.spans(buffer_):
+                if not rule.emitted:
+                    continue
+                if offsets:
+                    yield rule.name, start, end
+                else:
+                    yield Token(rule.name, buffer_[start:end])
+        finally:
+            if buffer_:
+                buffer_.close()
+
+
+def _precedences(acceptors):
+    """Map each acceptor to its precedence.
+
+    The final acceptor is the EOF's; the others are the rules', in order.
+    """
+    # Later rules get higher precedence.  This mimics reassignment in
+    # most languages: `x=1; x=2;` means `x==2`.
+    precedences = dict((acceptor, i) for i, acceptor in enumerate(acceptors))
+    # The EOF's precedence shouldn't matter, as it should never conflict
+    # with anything.  If something *does* conflict with EOF, we'd want to
+    # know about it.  So, EOF has the lowest precedence.
+    precedences[acceptors[-1]] = -1
+    return precedences
+
+
+def _accept_sets(matcher):
+    """Return the sets of acceptors a matcher's states accept, if known."""
+    if isinstance(matcher, dfa.Dfa):
+        return [state.accepts for state in matcher.accepting_states]
+    if isinstance(matcher, flatdfa.FlatDfa):
+        return [accepts for accepts in matcher.accepts if accepts]
+    return []
+
+
+def _split_points(text, chunk_size, split_at):
+    """Return (start, stop) pairs of the chunks of the text."""
+    chunks = []
+    start = 0
+    while start < len(text):
+        stop = start + chunk_size
+        if split_at and stop < len(text):
+            found = text.find(split_at, stop)
+            stop = len(text) if found == -1 else found + len(split_at)
+        stop = min(stop, len(text))
+        chunks.append((start, stop))
+        start = stop
+    return chunks or [(0, 0)]
+
+
+# The lexer of a lex_parallel worker process.
+_worker_lexer = None
+
+def _init_lex_worker(rules, engine):
+    global _worker_lexer
+    _worker_lexer = Lexer(rules, engine)
+
+
+def _lex_chunk(window):
+    """Speculatively lex a chunk in a worker process.
+
+    The window is a (chunk start, chunk length, text, final) tuple, where
+    the text is the chunk followed by its look-ahead, and final says
+    whether the text runs to the end of the input.  Return a list of
+    (rule index, start, end) tuples for the tokens that start within the
+    chunk, up to any point where lexing fails or a token's match runs
+    off the end of the look-ahead.
+    """
+    offset, length, text, final = window
+    lexer_ = _worker_lexer
+    rule_indexes = dict((rule, i) for i, rule in enumerate(lexer_.rules))
+    spans = []
+    position = 0
+    try:
+        while position < length:
+            result = lexer_.matcher.longest_match_at(text, position, final)
+            if result is None:
+                break
+            acceptors, end = result
+            rule = lexer_._rule(acceptors)
+            if rule is lexer_._eof_rule:
+                break
+            spans.append((rule_indexes[rule], offset + position, offset + end))
+            position = end
+    except ValueError:
+        pass
+    return spans
+
+
+class StreamLexer(object):
+    """Lexes input that is pushed to it in chunks.
+
+    Tokens may span chunks.  Between chunks, only the text of the
+    pending, unfinished token is kept, along with how far the matcher got
+    through it, so each character is matched once however many chunks a
+    token spans.
+    """
+
+    def __init__(self, lexer):
+        self._lexer = lexer
+        # The chunks of the pending token's text, all already matched.
+        self._pending = []
+        self._progress = nfa.Progress()
+
+    def feed(self, chunk):
+        """Add a chunk of input.
+
+        Return a list of the emitted tokens that the chunk completed.
+        """
+        return self._tokens(chunk, final=False)
+
+    def finish(self):
+        """Mark the end of the input.
+
+        Return a list of the remaining emitted tokens.
+        """
+        return self._tokens('', final=True)
+
+    def _tokens(self, chunk, final):
+        lexer = self._lexer
+        tokens = []
+        # Continue the pending token's match into the chunk.
+        result = lexer.matcher.longest_match_at(chunk, 0, final, self._progress)
+        if result is None:
+            self._pending.append(chunk)
+            return tokens
+        acceptors, end = result
+        rule = lexer._rule(acceptors)
+        if rule is lexer._eof_rule:
+            return tokens
+
+        # The match's end is relative to the chunk, so it's negative if
+        # the token ended in an earlier one.
+        text = ''.join(self._pending) + chunk
+        pending_length = len(text) - len(chunk)
+        position = pending_length + end
+        assert position > 0
+        if rule.emitted:
+            tokens.append(Token(rule.name, text[:position]))
+
+        # Lex the rest from scratch.  Only the characters read past the end
+        # of the token's match are read again.
+        while True:
+            self._progress = nfa.Progress()
+            result = lexer.matcher.longest_match_at(
+                text, position, final, self._progress)
+            if result is None:
+                # The token might continue into the next chunk.
+                self._pending = [text[position:]]
+                break
+            acceptors, end = result
+            rule = lexer._rule(acceptors)
+
+            if rule is lexer._eof_rule:
+                self._pending = []
+                break
+
+            assert end > position
+            if rule.emitted:
+                tokens.append(Token(rule.name, text[position:end]))
+            position = end
 
-    def lex_file(self, open_file):
-        """Break a file into tokens."""
-        for token in self.lex(charsource.chars_in_file(open_file)):
-            yield token
+        return tokens
@@ -0,0 +1,130 @@
+"""Unit tests for lexer."""
+import tempfile
+import unittest
+
+import finiteautomata
+import lexer
+import nfa
+import stats
+
+RULES = [
+    lexer.Rule('IDENTIFIER', '[a-z]+'),
+    lexer.Rule('IF', 'if'),
+    lexer.Rule('NUMBER', '[0-9]+'),
+    lexer.Rule('WHITESPACE', r'\s+', emitted=False),
+    ]
+
+def lex(input_str, **kwargs):
+    return [str(token) for token in lexer.Lexer(RULES, **kwargs).lex(input_str)]
+
+class TestLexer(unittest.TestCase):
+    def test_precedence_and_longest_match(self):
+        self.assertEqual(lex('if iffy 42'),
+                         ["IF('if')", "IDENTIFIER('iffy')", "NUMBER('42')"])
+
+    def test_engines_agree(self):
+        for engine in finiteautomata.ENGINES:
+            self.assertEqual(lex('x if 12 y3', engine=engine),
+                             ["IDENTIFIER('x')", "IF('if')", "NUMBER('12')",
+                              "IDENTIFIER('y')", "NUMBER('3')"])
+
+    def test_states_merge_when_winners_agree(self):
+        # 'a' is accepted by both rules, but B always wins.
+        rules = [lexer.Rule('A', 'a'), lexer.Rule('B', 'a|b')]
+        lex_ = lexer.Lexer(rules, engine='table')
+        # The start state, the state after 'a' or 'b', and the EOF's.
+        self.assertEqual(3, lex_.matcher.num_states)
+        self.assertEqual(["B('a')", "B('b')"],
+                         [str(token) for token in lex_.lex('ab')])
+
+    def test_acceptors_are_shared(self):
+        # Tokens of the same rule end in the same acceptors object, whose
+        # hash is cached for the lookup of the winning rule.
+        for engine in finiteautomata.ENGINES:
+            matcher = lexer.Lexer(RULES, engine=engine).matcher
+            first, unused_end = matcher.longest_match_at('abc 1', 0)
+            second, unused_end = matcher.longest_match_at('1 xyz', 2)
+            self.assertTrue(first is second)
+
+    def test_stats(self):
+        for text in ('if iffy 42', buffer('if iffy 42')):
+            stats_ = stats.Stats()
+            lex_ = lexer.Lexer(RULES, engine='compact', stats=stats_)
+            self.assertEqual(3, len(list(lex_.lex(text))))
+            self.assertEqual({'IF': 1, 'IDENTIFIER': 1, 'NUMBER': 1,
+                              'WHITESPACE': 2}, stats_.tokens)
+            self.assertEqual(10, stats_.chars_consumed)
+            # Each token but the last is followed by one character that
+            # ends it, which is read again for the next token.
+            self.assertEqual(4, stats_.chars_reread)
+            self.assertTrue(stats_.state_set_sizes)
+            self.assertTrue(stats_.timings['build_matcher'] > 0)
+
+    def test_buffers(self):
+        lex_ = lexer.Lexer(RULES, engine='table')
+        text = 'if iffy 42'
+        self.assertEqual([(rule.name, start, end)
+                          for rule, start, end in lex_.spans(text)],
+                         [('IF', 0, 2), ('WHITESPACE', 2, 3),
+                          ('IDENTIFIER', 3, 7), ('WHITESPACE', 7, 8),
+                          ('NUMBER', 8, 10)])
+        tokens = list(lex_.lex(memoryview(text)))
+        self.assertEqual(['IF', 'IDENTIFIER', 'NUMBER'],
+                         [token.type_name for token in tokens])
+        self.assertEqual('iffy', tokens[1].value.tobytes())
+
+    def test_lex_file(self):
+        lex_ = lexer.Lexer(RULES)
+        with tempfile.TemporaryFile() as open_file:
+            open_file.write('x 12\nif')
+            open_file.flush()
+            for mapped in (False, True):
+                open_file.seek(0)
+                self.assertEqual(
+                    ["IDENTIFIER('x')", "NUMBER('12')", "IF('if')"],
+                    [str(token) for token in lex_.lex_file(open_file, mapped)])
+                open_file.seek(0)
+                self.assertEqual(
+                    [('IDENTIFIER', 0, 1), ('NUMBER', 2, 4), ('IF', 5, 7)],
+                    list(lex_.lex_file(open_file, mapped, offsets=True)))
+
+    def test_lex_empty_file(self):
+        with tempfile.TemporaryFile() as open_file:
+            self.assertEqual(
+                [], list(lexer.Lexer(RULES).lex_file(open_file, mapped=True)))
+
+    def test_stream(self):
+        stream = lexer.Lexer(RULES).stream()
+        tokens = []
+        for chunk in ('i', 'f if', 'fy 4', '2', ' x'):
+            tokens.extend(stream.feed(chunk))
+        self.assertEqual(["IF('if')", "IDENTIFIER('iffy')", "NUMBER('42')"],
+                         [str(token) for token in tokens])
+        self.assertEqual(["IDENTIFIER('x')"],
+                         [str(token) for token in stream.finish()])
+
+    def test_stream_reads_each_char_once(self):
+        for engine in finiteautomata.ENGINES:
+            matcher = lexer.Lexer(RULES, engine).matcher
+            progress = nfa.Progress()
+            chunks = [stats.CountingBuffer('iffy' * 5) for _ in range(10)]
+            for chunk in chunks:
+                self.assertEqual(None, matcher.longest_match_at(
+                    chunk, 0, False, progress))
+            acceptors, end = matcher.longest_match_at(' ', 0, False, progress)
+            self.assertEqual(0, end)
+            self.assertEqual([20] * 10, [len(chunk.chars_read) for chunk in chunks])
+
+    def test_lex_parallel(self):
+        lex_ = lexer.Lexer(RULES, engine='table')
+        text = 'if iffy 42\nx 7 if\n  iffy\n\n42 y' * 5
+        expected = [str(token) for token in lex_.lex(text)]
+        for chunk_size, split_at in ((8, '\n'), (5, None)):
+            self.assertEqual(expected, [str(token) for token in lex_.lex_parallel(
+                text, processes=2, chunk_size=chunk_size, split_at=split_at)])
+        # Tokens that run past the look-ahead are lexed serially.
+        self.assertEqual(expected, [str(token) for token in lex_.lex_parallel(
+            text, processes=2, chunk_size=5, split_at=None, look_ahead=1)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""Finding the literal strings that every match of a Pattern must contain.
+
+Matchers use these to rule out text with plain string searches, which
+are much faster than running an automaton over it.
+"""
+
+import collections
+
+import pattern as p
+
+
+class Literals(collections.namedtuple(
+        'Literals', ['exact', 'prefix', 'suffix', 'required'])):
+    """The literals of a pattern.
+
+    exact: The only string the pattern matches, or None if there are
+        several.
+    prefix: A string every match starts with.
+    suffix: A string every match ends with.
+    required: A string every match contains.  This is the longest such
+        string found, so it is at least as long as prefix and suffix.
+    """
+
+
+_NOTHING = Literals(None, '', '', '')
+
+
+def _exactly(string):
+    return Literals(string, string, string, string)
+
+
+def _longest(*strings):
+    return max(strings, key=len)
+
+
+def common_prefix(strings):
+    """Return the longest string that all the strings start with."""
+    shortest, longest = min(strings), max(strings)
+    for i, char in enumerate(shortest):
+        if char != longest[i]:
+            return shortest[:i]
+    return shortest
+
+
+def _common_suffix(strings):
+    return common_prefix([string[::-1] for string in strings])[::-1]
+
+
+def analyze(pattern):
+    """Find the Literals of a Pattern."""
+    return p.fold(pattern, _analyze_one)
+
+
+def _analyze_one(pattern, parts):
+    """Find the Literals of a pattern, given those of its subpatterns."""
+    if isinstance(pattern, p.String):
+        return _exactly(pattern._contents)
+
+    if isinstance(pattern, p.Selection):
+        if not pattern.negating and len(set(pattern.candidates)) == 1:
+            return _exactly(pattern.candidates[0])
+        return _NOTHING
+
+    if isinstance(pattern, p.Range):
+        if pattern.low_character == pattern.high_character:
+            return _exactly(pattern.low_character)
+        return _NOTHING
+
+    if isinstance(pattern, p.Sequence):
+        return _analyze_sequence(parts)
+
+    if isinstance(pattern, p.Or):
+        alternatives = parts
+        if len(alternatives) == 1:
+            return alternatives[0]
+        exacts = set(alternative.exact for alternative in alternatives)
+        if len(exacts) == 1 and None not in exacts:
+            return alternatives[0]
+        prefix = common_prefix([alt.prefix for alt in alternatives])
+        suffix = _common_suffix([alt.suffix for alt in alternatives])
+        return Literals(None, prefix, suffix, _longest(prefix, suffix))
+
+    if isinstance(pattern, p.Plus):
+        literals, = parts
+        return literals._replace(exact=None)
+
+    if isinstance(pattern, p.Repeat):
+        if pattern.times_min == 0:
+            return _NOTHING
+        literals, = parts
+        if literals.exact is None:
+            return literals
+        repeated = literals.exact * pattern.times_min
+        if pattern.times_min == pattern.times_max:
+            return _exactly(repeated)
+        return Literals(None, repeated, repeated, repeated)
+
+    # Star, Maybe and Anything don't require anything in particular.
+    return _NOTHING
+
+
+def _analyze_sequence(parts):
+    """Combine the Literals of consecutive patterns."""
+    if all(part.exact is not None for part in parts):
+        return _exactly(''.join(part.exact for part in parts))
+
+    prefix = []
+    for part in parts:
+        if part.exact is None:
+            prefix.append(part.prefix)
+            break
+        prefix.append(part.exact)
+
+    suffix = []
+    for part in reversed(parts):
+        if part.exact is None:
+            suffix.append(part.suffix)
+            break
+        suffix.append(part.exact)
+
+    # A run of exact parts, plus the suffix before it and the prefix
+    # after it, is required as a whole.
+    required = ''
+    run = ''
+    for part in parts:
+        if part.exact is not None:
+            run += part.exact
+            continue
+        required = _longest(required, run + part.prefix, part.required)
+        run = part.suffix
+    required = _longest(required, run)
+
+    return Literals(None, ''.join(prefix), ''.join(reversed(suffix)), required)
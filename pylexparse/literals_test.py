@@ -0,0 +1,26 @@
+"""Unit tests for literals."""
+import unittest
+
+import literals
+import regex
+
+def analyze(regex_string):
+    return literals.analyze(regex.parse_regex(regex_string))
+
+class TestLiterals(unittest.TestCase):
+    def test_analyze(self):
+        self.assertEqual(literals.Literals('abab', 'abab', 'abab', 'abab'),
+                         analyze('a(b)a(b)'))
+        self.assertEqual(literals.Literals(None, 'if', 'e', 'if'),
+                         analyze('if[xy]+e'))
+        self.assertEqual(literals.Literals(None, '', 'end', 'beginner'),
+                         analyze('[xy]*beginn(er|er)[xy]*end'))
+        self.assertEqual(literals.Literals(None, 'ke', '', 'ke'),
+                         analyze('key|kept|ke(y|n)*'))
+
+    def test_common_prefix(self):
+        self.assertEqual('ke', literals.common_prefix(['key', 'kept', 'ke']))
+        self.assertEqual('', literals.common_prefix(['a', 'b']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,21 +2,57 @@
 
 import collections
 
+import charclasses
 import charsource
-from fixed_point import fixed_point
+import graph
+
+_NO_STATES = frozenset()
 
 class State(object):
     """A state of a Nondeterministic Finite Automaton.
 
     Includes outgoing transitions, instances reference other states.
+
+    Big patterns build hundreds of thousands of states, so each one
+    allocates as little as it can: no instance dict, and no range list
+    until it has a range transition.  Fewer container objects also means
+    less for the cyclic garbage collector to traverse.
     """
 
+    __slots__ = ('_transitions', '_ranges', 'closed_transitions')
+
     def __init__(self):
-        self._transitions = collections.defaultdict(set)
+        # Maps character -> set of destinations.
+        self._transitions = {}
+        # A (low, high, destination) tuple for each range transition.
+        self._ranges = ()
+        # Set by Nfa.freeze: maps character class -> epsilon closure of
+        # the destinations along that class.
+        self.closed_transitions = None
 
     def add_transition(self, character, destination):
         """Specify a transition to a new state via a character."""
-        self._transitions[character].add(destination)
+        destinations = self._transitions.get(character)
+        if destinations is None:
+            destinations = self._transitions[character] = set()
+        destinations.add(destination)
+
+    def add_range_transition(self, low, high, destination):
+        """Specify a transition to a new state via any character in a range.
+
+        The range includes both low and high.
+        """
+        if not self._ranges:
+            self._ranges = []
+        self._ranges.append((low, high, destination))
+
+    def add_labeled_transition(self, label, destination):
+        """Add a transition along a label, as yielded by iterating a State."""
+        if isinstance(label, tuple):
+            low, high = label
+            self.add_range_transition(low, high, destination)
+        else:
+            self.add_transition(label, destination)
 
     def add_empty_transition(self, destination):
         """Add an empty transition to another state."""
@@ -25,12 +61,15 @@ class State(object):
     def __iter__(self):
         """Get an iterator over outgoing transitions.
 
-        Yields: A (character, destination_state) pair for each outgoing
-           transition.
+        Yields: A (label, destination_state) pair for each outgoing
+           transition.  The label is a character, or a (low, high) tuple
+           for a range transition.
         """
         for character, destinations in self._transitions.iteritems():
             for destination in destinations:
                 yield (character, destination)
+        for low, high, destination in self._ranges:
+            yield (low, high), destination
 
     def successors(self):
         """Yield all successor states of this state.
@@ -42,7 +81,21 @@ class State(object):
             yield destination
 
     def follow(self, character):
-        return self._transitions[character]
+        destinations = self._transitions.get(character, _NO_STATES)
+        if not self._ranges or not character:
+            return destinations
+        code = ord(character)
+        in_range = [destination for low, high, destination in self._ranges
+                    if ord(low) <= code <= ord(high)]
+        return destinations.union(in_range) if in_range else destinations
+
+    def follow_closed(self, char_class):
+        """Get the epsilon closure of the destinations along a character class.
+
+        Only available once the state's NFA is frozen.  See
+        charclasses.CharClasses.
+        """
+        return self.closed_transitions.get(char_class, _NO_STATES)
 
 
 class Fragment(object):
@@ -91,6 +144,14 @@ class Fragment(object):
         # TODO(jasonpr): Consider somehow ruining the siblings, so nobody
         # attempts to use the old, unusable fragment.
 
+    def copy(self):
+        """Return an unconnected copy of this fragment, with new states."""
+        copies = collections.defaultdict(State)
+        for state in graph.reachable(self.start):
+            for label, destination in state:
+                copies[state].add_labeled_transition(label, copies[destination])
+        return Fragment(copies[self.start], copies[self.end])
+
     @staticmethod
     def chain(first, *rest):
         chain = first
@@ -110,19 +171,124 @@ class Nfa(object):
     def __init__(self, start, accepting_states):
         self.start = start
         self.accepting = set(accepting_states)
+        self.frozen = False
+        self._start_states = None
+        # Set by freeze: the character classes of the transition labels.
+        self.classes = None
+        # Maps each set of accepting states met -> its one frozenset.
+        self._accepted_states = {}
 
     @classmethod
     def from_fragment(cls, fragment):
         return cls(fragment.start, [fragment.end])
 
+    def freeze(self):
+        """Precompute the epsilon closure of every state.
+
+        Afterwards, each state's closed_transitions lead straight to the
+        epsilon closures of its destinations, so matching never follows
+        an empty transition.  They are keyed by character class, so a
+        range transition costs one entry per class it spans, rather than
+        one per character.  No states may be changed once frozen, so
+        freezing an NFA again does nothing.
+
+        Returns this NFA.
+        """
+        if self.frozen:
+            return self
+        states = list(graph.reachable(self.start))
+        self.classes = charclasses.CharClasses.from_labels(
+            label for state in states for label, unused_destination in state)
+        closures = dict(
+            (state, frozenset(epsilon_closure(state))) for state in states)
+        # Share unions of closures between states, rather than copying them.
+        unions = {}
+        for state in states:
+            by_class = collections.defaultdict(set)
+            for label, destination in state:
+                if label != '':
+                    for char_class in self.classes.classes_of(label):
+                        by_class[char_class].add(destination)
+            closed = {}
+            for char_class, destinations in by_class.iteritems():
+                destinations = frozenset(destinations)
+                if destinations not in unions:
+                    unions[destinations] = frozenset().union(
+                        *(closures[destination] for destination in destinations))
+                closed[char_class] = unions[destinations]
+            state.closed_transitions = closed
+        self._start_states = closures[self.start]
+        self.frozen = True
+        return self
+
+    def mark_frozen(self, classes, start_states):
+        """Mark this NFA frozen, with closures computed by an earlier freeze.
+
+        Every state's closed_transitions must already be set, keyed by
+        the classes' character classes.  serialize uses this to load
+        frozen NFAs without recomputing their closures.
+
+        Returns this NFA.
+        """
+        self.classes = classes
+        self._start_states = start_states
+        self.frozen = True
+        return self
+
+    def start_states(self):
+        """Return the states the NFA is in before reading any input."""
+        if self.frozen:
+            return self._start_states
+        return frozenset(epsilon_closure(self.start))
+
+    def accepted_states(self, acceptors):
+        """Return a set of accepting states as a shared frozenset.
+
+        Like compactnfa.CompactNfa.accepted_states, every match ending
+        in the same accepting states gets the same object, whose hash is
+        cached, so lexers can look it up cheaply.
+        """
+        if not acceptors:
+            return _NO_STATES
+        acceptors = frozenset(acceptors)
+        return self._accepted_states.setdefault(acceptors, acceptors)
+
+    def step(self, states, char):
+        """Return the states reached from some states along a character."""
+        if self.frozen:
+            return advance_frozen(states, self.classes.classify(char))
+        return advance(states, char)
+
     def match(self, candidate):
         """Match the candidate against this NFA.
 
-        Return matching states.
+        Return the accepting states of the match.
         """
-        states, match = self.longest_match(charsource.RewindSource(candidate))
-        return states if match == candidate else set()
+        return charsource.full_match(self, candidate)
 
+    def match_many(self, candidates, required=''):
+        """Match each of many candidates against this NFA.
+
+        Args:
+            candidates: An iterable of strings.
+            required: A string every match contains, if known.  Candidates
+                without it are rejected without running the NFA.
+        Yields the matching states for each candidate, in order, or an
+        empty set if it doesn't match.
+        """
+        start_states = self.start_states()
+        step = self.step
+        accepting = self.accepting
+        for candidate in candidates:
+            if charsource.lacks(candidate, required):
+                yield _NO_STATES
+                continue
+            states = start_states
+            for char in candidate:
+                states = step(states, char)
+                if not states:
+                    break
+            yield states & accepting
 
     def longest_match(self, source):
         """Find the longest match, starting from the first character.
@@ -131,9 +297,10 @@ class Nfa(object):
             source: A RewindSource of characters.
         Return (matching states, matching string) tuple.
         """
-        states = set(epsilon_closure(self.start))
+        states = self.start_states()
+        step = self.step
 
-        match = set(), 0
+        match = _NO_STATES, 0
 
         for i, char in enumerate(source):
             if not states:
@@ -141,7 +308,7 @@ class Nfa(object):
             acceptors = states & self.accepting
             if acceptors:
                 match = acceptors, i
-            states = advance(states, char)
+            states = step(states, char)
         length = i + 1
 
         # Do one more check after the final advance step.
@@ -152,7 +319,82 @@ class Nfa(object):
         matching_states, match_length = match
         matching_string = source.disown_first(match_length)
         source.rewind()
-        return matching_states, matching_string
+        return self.accepted_states(matching_states), matching_string
+
+    def longest_match_at(self, buffer, position, final=True,
+                         progress=None):
+        """Find the longest match in a buffer, starting at a position.
+
+        Reads the buffer by index, one past its end for the EOF (None).
+
+        Args:
+            buffer: A str, unicode, buffer, memoryview or mmap.
+            position: The index at which the match must start.
+            final: Whether the buffer holds the rest of the input.  If
+                not, running off the end means more input is needed.
+            progress: A Progress, to save the match's progress in when
+                more input is needed, and to continue from if it saved
+                some earlier.
+        Return (matching states, end position) tuple.  The end is the
+            start position if nothing matched.  If the buffer isn't final
+            and the match could continue past its end, return None.
+        """
+        states = self.start_states()
+        step = self.step
+        accepting = self.accepting
+        end = len(buffer)
+
+        match = _NO_STATES, position
+        if progress is not None:
+            states, match = progress.resumed(states, match, position)
+
+        while states:
+            acceptors = states & accepting
+            if acceptors:
+                match = acceptors, position
+            if position < end:
+                char = buffer[position]
+            elif final:
+                char = None
+            else:
+                if progress is not None:
+                    progress.save(states, match, end)
+                return None
+            states = step(states, char)
+            position += 1
+
+        matching_states, match_end = match
+        return self.accepted_states(matching_states), match_end
+
+
+class Progress(object):
+    """How far a longest match got before running off a non-final buffer.
+
+    Passing the same Progress to longest_match_at for the next buffer
+    continues the match where it left off, so no character is read twice.
+    Every engine's longest_match_at supports this.
+    """
+
+    def __init__(self):
+        self._saved = None
+
+    def save(self, state, match, end):
+        """Remember the automaton's state and best match at a buffer's end."""
+        accepted, match_end = match
+        # The match's end, relative to the end of the buffer.
+        self._saved = state, accepted, match_end - end
+
+    def resumed(self, state, match, position):
+        """Return the (state, match) to start from at a position.
+
+        That is the saved ones, if any, with the position taking the
+        place of the end of the earlier buffer.  Otherwise, it's the given
+        initial state and empty match.
+        """
+        if self._saved is None:
+            return state, match
+        state, accepted, offset = self._saved
+        return state, (accepted, position + offset)
 
 
 def advance(states, char):
@@ -164,8 +406,15 @@ def advance(states, char):
     return multi_epsilon_closure(next_states)
 
 
-@fixed_point(set)
-def epsilon_closure(state, _epsilon_closure):
+def advance_frozen(states, char_class):
+    """Like advance, but for states of a frozen NFA and a character class."""
+    next_states = set()
+    for state in states:
+        next_states |= state.follow_closed(char_class)
+    return next_states
+
+
+def epsilon_closure(state):
     """Find all states that can be reached by following empty transitions.
 
     In contrast with the usual description of the epsilon closure,
@@ -173,14 +422,17 @@ def epsilon_closure(state, _epsilon_closure):
     multi_epsilon_closure takes a set of states, and returns the union
     of their epsilon clousres.
     """
-    result = set([state])
-    for follower in state.follow(''):
-        result |= _epsilon_closure(follower)
-    return result
+    return multi_epsilon_closure([state])
 
 def multi_epsilon_closure(states):
     """Find the epsilon closure of several states and return their union."""
-    result = set()
-    for state in states:
-        result |= epsilon_closure(state)
+    # Like graph.dfs, but only along empty transitions.  Each state is
+    # expanded once, however many of the states reach it.
+    result = set(states)
+    agenda = collections.deque(result)
+    while agenda:
+        for follower in agenda.pop().follow(''):
+            if follower not in result:
+                result.add(follower)
+                agenda.append(follower)
     return result
@@ -0,0 +1,240 @@
+"""Rewriting Patterns into simpler, equivalent Patterns.
+
+Simpler patterns compile into smaller NFAs, which are faster both to
+build and to run.
+"""
+
+import charclasses
+import literals
+import pattern as p
+
+# The widest Range worth expanding into a Selection, which can then be
+# merged with other alternatives.
+_MAX_EXPANDED_RANGE = 256
+
+
+def simplify(pattern):
+    """Return a Pattern that matches the same strings, with fewer NFA states.
+
+    Does not modify the given pattern.
+    """
+    return p.fold(pattern, _simplify_one)
+
+
+def _simplify_one(pattern, parts):
+    """Simplify a pattern, given its already simplified subpatterns."""
+    if isinstance(pattern, p.Sequence):
+        return _sequence(parts)
+
+    if isinstance(pattern, p.Or):
+        return _alternation(parts)
+
+    if isinstance(pattern, p.Star):
+        inner, = parts
+        # (x*)*, (x+)* and (x?)* are all x*.
+        while isinstance(inner, (p.Star, p.Plus, p.Maybe)):
+            inner = inner.pattern
+        return p.Star(inner)
+
+    if isinstance(pattern, p.Plus):
+        inner, = parts
+        if isinstance(inner, (p.Star, p.Plus)):
+            return inner
+        return p.Plus(inner)
+
+    if isinstance(pattern, p.Maybe):
+        inner, = parts
+        if isinstance(inner, (p.Star, p.Maybe)):
+            return inner
+        return p.Maybe(inner)
+
+    if isinstance(pattern, p.Repeat):
+        inner, = parts
+        return p.Repeat(inner, pattern.times_min, pattern.times_max)
+
+    if isinstance(pattern, p.Range):
+        low, high = ord(pattern.low_character), ord(pattern.high_character)
+        if high - low >= _MAX_EXPANDED_RANGE:
+            # Compiles to a single range transition anyway.
+            return pattern
+        return _selection(set(charclasses.char(index)
+                              for index in range(low, high + 1)))
+
+    if isinstance(pattern, p.Selection) and not pattern.negating:
+        return _selection(set(pattern.candidates))
+
+    return pattern
+
+
+def _selection(chars):
+    """Return a pattern matching any one of a set of characters."""
+    if len(chars) == 1:
+        return p.String(next(iter(chars)))
+    return p.Selection(''.join(sorted(chars)))
+
+
+def _single_chars(pattern):
+    """Return the set of characters a one-character pattern matches, or None."""
+    if isinstance(pattern, p.String) and len(pattern._contents) == 1:
+        return set(pattern._contents)
+    if isinstance(pattern, p.Selection) and not pattern.negating:
+        return set(pattern.candidates)
+    return None
+
+
+def _sequence(parts):
+    """Join simplified patterns in sequence."""
+    flat = []
+    for part in parts:
+        if isinstance(part, p.Sequence):
+            flat.extend(part.patterns)
+        else:
+            flat.append(part)
+
+    # Merge adjacent strings.
+    merged = []
+    for part in flat:
+        if (isinstance(part, p.String) and merged and
+                isinstance(merged[-1], p.String)):
+            merged[-1] = p.String(merged[-1]._contents + part._contents)
+        else:
+            merged.append(part)
+
+    if len(merged) == 1:
+        return merged[0]
+    return p.Sequence(*merged)
+
+
+def _leading_string(pattern):
+    """Return the literal string a pattern starts with, or ''."""
+    if isinstance(pattern, p.String):
+        return pattern._contents
+    if isinstance(pattern, p.Sequence) and isinstance(pattern.patterns[0], p.String):
+        return pattern.patterns[0]._contents
+    return ''
+
+
+def _strip_leading(pattern, length):
+    """Remove the first characters of a pattern's leading string.
+
+    Return the rest of the pattern, or None if nothing is left.
+    """
+    if isinstance(pattern, p.String):
+        rest = pattern._contents[length:]
+        return p.String(rest) if rest else None
+    first, rest = pattern.patterns[0], list(pattern.patterns[1:])
+    if len(first._contents) > length:
+        rest.insert(0, p.String(first._contents[length:]))
+    return _sequence(rest)
+
+
+def _alternation(parts):
+    """Join simplified patterns as alternatives.
+
+    Factoring out a shared prefix leaves the alternation of the rests,
+    which may share prefixes of their own.  Those alternations wait on an
+    explicit stack, as in pattern.fold, so that prefixes can nest deeper
+    than Python's recursion limit.
+    """
+    # Holds (alternatives, factored) pairs.  factored is None until the
+    # alternatives have been factored, and the alternations of their
+    # groups' rests pushed, to be joined before them.
+    agenda = [(parts, None)]
+    values = []
+    while agenda:
+        alternatives, factored = agenda.pop()
+        if factored is None:
+            factored, rests = _factor(alternatives)
+            if rests:
+                agenda.append((alternatives, factored))
+                agenda.extend([(group_rests, None)
+                               for group_rests in reversed(rests)])
+                continue
+            values.append(_join(factored, []))
+            continue
+        num_groups = sum(1 for alternative in factored
+                         if isinstance(alternative, tuple))
+        first = len(values) - num_groups
+        value = _join(factored, values[first:])
+        del values[first:]
+        values.append(value)
+    return values[0]
+
+
+def _factor(parts):
+    """Factor out prefixes shared by alternatives.
+
+    Alternatives that start with the same character are grouped, so
+    keywords like 'if|int|in' become 'i(f|n(t)?)'.  Return a list of
+    the factored alternatives, and a list of each group's rests, which
+    are still to be joined as alternatives.  In the first list, each
+    group is a (prefix, optional) tuple, where optional says whether
+    the group's rests may be skipped.
+    """
+    flat = []
+    seen = set()
+    for part in parts:
+        for alternative in (part.patterns if isinstance(part, p.Or) else [part]):
+            if alternative not in seen:
+                seen.add(alternative)
+                flat.append(alternative)
+
+    groups = {}
+    alternatives = []
+    for alternative in flat:
+        leading = _leading_string(alternative)
+        if leading:
+            if leading[0] not in groups:
+                groups[leading[0]] = []
+                alternatives.append(leading[0])
+            groups[leading[0]].append(alternative)
+        else:
+            alternatives.append(alternative)
+
+    factored = []
+    all_rests = []
+    for alternative in alternatives:
+        if not isinstance(alternative, basestring):
+            factored.append(alternative)
+            continue
+        group = groups[alternative]
+        if len(group) == 1:
+            factored.append(group[0])
+            continue
+        prefix = literals.common_prefix(
+            [_leading_string(member) for member in group])
+        rests = [_strip_leading(member, len(prefix)) for member in group]
+        factored.append((prefix, None in rests))
+        all_rests.append([rest for rest in rests if rest is not None])
+    return factored, all_rests
+
+
+def _join(factored, remainders):
+    """Join factored alternatives, given the alternations of their groups' rests."""
+    remainders = iter(remainders)
+    joined = []
+    for alternative in factored:
+        if isinstance(alternative, tuple):
+            prefix, optional = alternative
+            remainder = next(remainders)
+            if optional:
+                remainder = p.Maybe(remainder)
+            alternative = _sequence([p.String(prefix), remainder])
+        joined.append(alternative)
+
+    # Collapse one-character alternatives into a single selection.
+    chars = set()
+    others = []
+    for alternative in joined:
+        alternative_chars = _single_chars(alternative)
+        if alternative_chars is None:
+            others.append(alternative)
+        else:
+            chars |= alternative_chars
+    if chars or not others:
+        # An empty class is an empty selection, which matches nothing.
+        others.insert(0, _selection(chars))
+
+    if len(others) == 1:
+        return others[0]
+    return p.Or(*others)
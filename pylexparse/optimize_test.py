@@ -0,0 +1,45 @@
+"""Unit tests for optimize."""
+import sys
+import unittest
+
+import finiteautomata
+import pattern
+import regex
+import regex_test
+
+def simplified(regex_string):
+    return repr(regex.parse_regex(regex_string).simplified())
+
+class TestOptimize(unittest.TestCase):
+    def test_simplify(self):
+        self.assertEqual('(i)((f)|((n)((t)?)))', simplified('if|in|int'))
+        self.assertEqual('(abcd)*', simplified('(ab(cd))*'))
+        self.assertEqual('[abcx]', simplified('a|[bc]|x|a'))
+        self.assertTrue(regex_test.match('if|in|int', 'in'))
+        self.assertFalse(regex_test.match('if|in|int', 'i'))
+
+    def test_flattened_repeats(self):
+        # Flattened stars, pluses and maybes keep their own start and end.
+        for engine in finiteautomata.ENGINES:
+            self.assertFalse(regex_test.match('0(x[0-9a-f]+)?', '05', engine))
+            self.assertTrue(regex_test.match('0(x[0-9a-f]+)?', '0x5f', engine))
+            self.assertFalse(regex_test.match('x(y[0-9]+)?', 'x5', engine))
+            self.assertFalse(regex_test.match('(a+,)*', 'a', engine))
+            self.assertTrue(regex_test.match('(a+,)*', 'aa,a,', engine))
+            self.assertFalse(regex_test.match('((a)+c)*', 'aca', engine))
+            # An empty class matches nothing.
+            self.assertFalse(regex_test.match('[]', 'a', engine))
+            self.assertTrue(regex_test.match('([])*', '', engine))
+            self.assertFalse(regex_test.match('([])*', 'a', engine))
+
+    def test_deep_prefixes(self):
+        # Each alternative shares a longer prefix with the next, so the
+        # factored prefixes nest deeper than the recursion limit.
+        depth = sys.getrecursionlimit() + 100
+        alternatives = [pattern.String('a' * i + 'b') for i in range(1, depth)]
+        deep = pattern.Or(*alternatives).simplified()
+        self.assertTrue(deep.match('a' * (depth - 1) + 'b'))
+        self.assertFalse(deep.match('a' * depth + 'b'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,26 +1,269 @@
+import multiprocessing
 import string
 
+import cache
+import charclasses
+import charsource
+import finiteautomata
+import literals as literal_analysis
 import nfa
+import optimize
+import search as searching
 
 # TODO(jasonpr): Check that string.printable is what we want.
 _ALL_CHARS = set(string.printable)
 
+# Maps (Pattern, engine) -> compiled automaton.
+compile_cache = cache.LruCache()
+
+
+def fold(pattern, combine):
+    """Compute a value for a pattern from the values of its subpatterns.
+
+    Calls combine(current, values) for every pattern in the tree, bottom
+    up, where values lists the results for the current pattern's own
+    subpatterns.  Returns the result for the whole pattern.
+
+    Works from an explicit stack, like graph.dfs, so patterns can nest
+    deeper than Python's recursion limit.
+    """
+    # Holds (pattern, subpatterns) pairs.  Subpatterns are None until the
+    # pattern's subpatterns have been pushed, to be combined before it.
+    agenda = [(pattern, None)]
+    values = []
+    while agenda:
+        current, subpatterns = agenda.pop()
+        if subpatterns is None:
+            subpatterns = current.subpatterns()
+            if subpatterns:
+                agenda.append((current, subpatterns))
+                agenda.extend([(subpattern, None)
+                               for subpattern in reversed(subpatterns)])
+                continue
+        if subpatterns:
+            first = len(values) - len(subpatterns)
+            value = combine(current, values[first:])
+            del values[first:]
+        else:
+            value = combine(current, [])
+        values.append(value)
+    return values[0]
+
+
+def _own_key(pattern):
+    """Return the part of a pattern's _key that isn't its subpatterns."""
+    key = pattern._key()
+    if isinstance(key, Pattern):
+        return ()
+    if isinstance(key, tuple):
+        return tuple(part for part in key if not isinstance(part, Pattern))
+    return key
+
+
 class Pattern(object):
     """Base class for all patterns, besides strings"""
 
-    def compiled(self):
-        return nfa.Nfa.from_fragment(self._fragment())
+    def _key(self):
+        """Return a hashable value that identifies this pattern's structure."""
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        # Compare subpatterns from an explicit stack, like __hash__, since
+        # comparing whole _key()s would recurse through them.
+        agenda = [(self, other)]
+        while agenda:
+            mine, theirs = agenda.pop()
+            if mine is theirs:
+                continue
+            if (type(mine) is not type(theirs) or hash(mine) != hash(theirs) or
+                _own_key(mine) != _own_key(theirs)):
+                return False
+            my_subpatterns = mine.subpatterns()
+            their_subpatterns = theirs.subpatterns()
+            if len(my_subpatterns) != len(their_subpatterns):
+                return False
+            agenda.extend(zip(my_subpatterns, their_subpatterns))
+        return True
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            pass
+        # Hash the subpatterns bottom up, so that hashing each key only
+        # looks up hashes that are already cached.
+        agenda = [self]
+        unhashed = []
+        while agenda:
+            current = agenda.pop()
+            if not hasattr(current, '_hash'):
+                unhashed.append(current)
+                agenda.extend(current.subpatterns())
+        for current in reversed(unhashed):
+            current._hash = hash((type(current), current._key()))
+        return self._hash
+
+    def subpatterns(self):
+        """Return the list of patterns directly inside this one."""
+        return []
+
+    def _fragment(self):
+        """Build a new NFA fragment that matches this pattern."""
+        return fold(self, lambda pattern, fragments:
+                    pattern._combine_fragments(fragments))
+
+    def _combine_fragments(self, fragments):
+        """Build this pattern's fragment from its subpatterns' fragments."""
+        raise NotImplementedError
+
+    def compiled(self, engine='nfa'):
+        """Build an automaton for this pattern.
+
+        Structurally equal patterns share their automata, through
+        compile_cache.  See finiteautomata.build_matcher for the
+        available engines.
+        """
+        return compile_cache.get((self, engine), lambda: self._compile(engine))
+
+    def _compile(self, engine):
+        return finiteautomata.build_matcher(
+            nfa.Nfa.from_fragment(self.simplified()._fragment()), engine)
+
+    def simplified(self):
+        """Return an equivalent pattern that compiles to a smaller NFA."""
+        try:
+            return self._simplified
+        except AttributeError:
+            self._simplified = optimize.simplify(self)
+            return self._simplified
+
+    def literals(self):
+        """Return the literals.Literals that every match must contain."""
+        try:
+            return self._literals
+        except AttributeError:
+            self._literals = literal_analysis.analyze(self)
+            return self._literals
+
+    def _ruled_out(self, candidate):
+        """Return whether a candidate lacks a string every match needs."""
+        return charsource.lacks(candidate, self.literals().required)
+
+    def match(self, candidate, engine='nfa'):
+        if self._ruled_out(candidate):
+            return False
+        return bool(self.compiled(engine).match(candidate))
+
+    def search(self, text, engine='nfa', position=0):
+        """Find the leftmost-longest match within a text.
+
+        Return the (start, end) span of the match, or None.
+        """
+        literals = self.literals()
+        return searching.search(self.compiled(engine), text, position,
+                                literals.prefix, literals.required)
+
+    def finditer(self, text, engine='nfa'):
+        """Yield the (start, end) span of each non-overlapping match in a text."""
+        literals = self.literals()
+        return searching.finditer(self.compiled(engine), text,
+                                  literals.prefix, literals.required)
+
+    def match_many(self, candidates, engine='nfa', processes=1,
+                   chunk_size=1024):
+        """Match each of many candidates against this pattern.
+
+        Yields whether each candidate matches, in order.  The pattern is
+        compiled once for the whole batch.
+
+        Args:
+            candidates: An iterable of strings.
+            engine: See finiteautomata.build_matcher.
+            processes: The number of processes to match in.  None means
+                one per CPU.
+            chunk_size: The number of candidates to send to a process
+                at a time.
+        """
+        if processes == 1:
+            matcher = self.compiled(engine)
+            if isinstance(matcher, nfa.Nfa):
+                for states in matcher.match_many(
+                        candidates, self.literals().required):
+                    yield bool(states)
+            else:
+                for candidate in candidates:
+                    yield (not self._ruled_out(candidate) and
+                           bool(matcher.match(candidate)))
+            return
+
+        pool = multiprocessing.Pool(
+            processes, _init_match_worker, (self, engine))
+        try:
+            for result in pool.imap(_match_in_worker, candidates, chunk_size):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+# The automaton of a match_many worker process.
+_worker_matcher = None
+
+def _init_match_worker(pattern, engine):
+    global _worker_matcher
+    _worker_matcher = pattern.compiled(engine)
+
+
+def _match_in_worker(candidate):
+    return bool(_worker_matcher.match(candidate))
+
+
+def _chars_to_fragment(chars):
+    """Build a fragment matching any one character from a set.
+
+    Each run of consecutive characters becomes a single range transition.
+    """
+    start, end = nfa.State(), nfa.State()
+    codes = sorted(ord(char) for char in chars)
+    run_start = 0
+    for i, code in enumerate(codes):
+        if i + 1 < len(codes) and codes[i + 1] == code + 1:
+            continue
+        low, high = codes[run_start], code
+        if low == high:
+            start.add_transition(charclasses.char(low), end)
+        else:
+            start.add_range_transition(
+                charclasses.char(low), charclasses.char(high), end)
+        run_start = i + 1
+    return nfa.Fragment(start, end)
+
+
+def _single_step_labels(fragment):
+    """Return the labels of a fragment that is a single step, or None.
+
+    A single step is a start state whose transitions all lead straight to
+    the end state, along characters or ranges.  A fragment that matches
+    only the empty string isn't one.
+    """
+    if fragment.start is fragment.end or any(True for _ in fragment.end):
+        return None
+    labels = []
+    for label, destination in fragment.start:
+        if label == '' or destination is not fragment.end:
+            return None
+        labels.append(label)
+    return labels or None
 
-    def match(self, candidate):
-        return bool(self.compiled().match(candidate))
 
 def _string_to_fragment(pattern_str):
-    if len(pattern_str) == 1:
-        start, end = nfa.State(), nfa.State()
-        start.add_transition(pattern_str, end)
-        return nfa.Fragment(start, end)
-    # Otherwise, we must chain together one fragment per character.
-    return nfa.Fragment.chain(*(_string_to_fragment(char) for char in pattern_str))
+    # One state per character boundary, with no empty transitions between.
+    states = [nfa.State() for _ in range(len(pattern_str) + 1)]
+    for char, state, follower in zip(pattern_str, states, states[1:]):
+        state.add_transition(char, follower)
+    return nfa.Fragment(states[0], states[-1])
 
 
 class String(Pattern):
@@ -30,7 +273,10 @@ class String(Pattern):
     def __repr__(self):
         return self._contents
 
-    def _fragment(self):
+    def _key(self):
+        return self._contents
+
+    def _combine_fragments(self, unused_fragments):
         return _string_to_fragment(self._contents)
 
 
@@ -43,9 +289,14 @@ class Sequence(Pattern):
     def __repr__(self):
         return ''.join('(%s)' % pattern for pattern in self.patterns)
 
-    def _fragment(self):
-        return nfa.Fragment.chain(
-            *(pattern._fragment() for pattern in self.patterns))
+    def _key(self):
+        return tuple(self.patterns)
+
+    def subpatterns(self):
+        return self.patterns
+
+    def _combine_fragments(self, fragments):
+        return nfa.Fragment.chain(*fragments)
 
 class Star(Pattern):
     """Zero or more occurrences of a pattern."""
@@ -56,10 +307,20 @@ class Star(Pattern):
     def __repr__(self):
         return '(%s)*' % self.pattern
 
-    def _fragment(self):
-        pattern_frag = self.pattern._fragment()
+    def _key(self):
+        return self.pattern
+
+    def subpatterns(self):
+        return [self.pattern]
+
+    def _combine_fragments(self, fragments):
+        pattern_frag, = fragments
+        start, end = nfa.State(), nfa.State()
+        start.add_empty_transition(pattern_frag.start)
+        start.add_empty_transition(end)
         pattern_frag.end.add_empty_transition(pattern_frag.start)
-        return nfa.Fragment(pattern_frag.start, pattern_frag.start)
+        pattern_frag.end.add_empty_transition(end)
+        return nfa.Fragment(start, end)
 
 class Plus(Pattern):
     def __init__(self, pattern):
@@ -68,10 +329,19 @@ class Plus(Pattern):
     def __repr__(self):
         return '(%s)+' % self.pattern
 
-    def _fragment(self):
-        pattern_frag = plus.pattern._fragment()
+    def _key(self):
+        return self.pattern
+
+    def subpatterns(self):
+        return [self.pattern]
+
+    def _combine_fragments(self, fragments):
+        pattern_frag, = fragments
+        start, end = nfa.State(), nfa.State()
+        start.add_empty_transition(pattern_frag.start)
         pattern_frag.end.add_empty_transition(pattern_frag.start)
-        return pattern_frag
+        pattern_frag.end.add_empty_transition(end)
+        return nfa.Fragment(start, end)
 
 class Or(Pattern):
     """Exactly one pattern from one or more candidates."""
@@ -82,14 +352,17 @@ class Or(Pattern):
     def __repr__(self):
         return '|'.join('(%s)' % pattern for pattern in self.patterns)
 
-    def _fragment(self):
-        # TODO(jasonpr): Update fragment intefrace so that the first
-        # fragment doesn't seem special... since it isn't!
-        first, rest = self.patterns[0], self.patterns[1:]
+    def _key(self):
+        return tuple(self.patterns)
 
-        result = first._fragment()
-        result.add_in_parallel(*(pattern._fragment() for pattern in rest))
+    def subpatterns(self):
+        return self.patterns
 
+    def _combine_fragments(self, fragments):
+        # TODO(jasonpr): Update fragment intefrace so that the first
+        # fragment doesn't seem special... since it isn't!
+        result, rest = fragments[0], fragments[1:]
+        result.add_in_parallel(*rest)
         return result
 
 class Maybe(Pattern):
@@ -101,10 +374,19 @@ class Maybe(Pattern):
     def __repr__(self):
         return '(%s)?' % self.pattern
 
-    def _fragment(self):
-        fragment = self.pattern._fragment()
-        fragment.start.add_empty_transition(fragment.end)
-        return fragment
+    def _key(self):
+        return self.pattern
+
+    def subpatterns(self):
+        return [self.pattern]
+
+    def _combine_fragments(self, fragments):
+        fragment, = fragments
+        start, end = nfa.State(), nfa.State()
+        start.add_empty_transition(fragment.start)
+        start.add_empty_transition(end)
+        fragment.end.add_empty_transition(end)
+        return nfa.Fragment(start, end)
 
 
 
@@ -114,8 +396,11 @@ class Anything(Pattern):
     def __repr__(self):
         return '.'
 
-    def _fragment(self):
-        return self.Selection(_ALL_CHARS._fragment())
+    def _key(self):
+        return None
+
+    def _combine_fragments(self, unused_fragments):
+        return _chars_to_fragment(_ALL_CHARS)
 
 
 class Selection(Pattern):
@@ -128,14 +413,14 @@ class Selection(Pattern):
     def __repr__(self):
         return '[%s%s]' % ('^' if self.negating else '', self.candidates)
 
-    def _fragment(self):
-        start, end = nfa.State(), nfa.State()
+    def _key(self):
+        return frozenset(self.candidates), self.negating
+
+    def _combine_fragments(self, unused_fragments):
         candidates = set(self.candidates)
         if self.negating:
             candidates = _ALL_CHARS - candidates
-        for char in candidates:
-            start.add_transition(char, end)
-        return nfa.Fragment(start, end)
+        return _chars_to_fragment(candidates)
 
 
 class Repeat(Pattern):
@@ -149,21 +434,56 @@ class Repeat(Pattern):
     def __repr__(self):
         return '(%s){%d,%d}' % (self.pattern, self.times_min, self.times_max)
 
-    def _fragment(self):
-        min_chain = nfa.Fragment.chain(
-            *(self.pattern._fragment() for _ in range(self.times_min)))
-
-        maybe_times = self.times_max - self.times_min
-        if maybe_times:
-            maybes = (pattern.Maybe(self.pattern) for _ in range(maybe_times))
-            max_fragments = (pat._fragment() for pat in maybes)
-            return nfa.Fragment.chain(min_chain, *max_fragments)
-        else:
-            return min_chain
+    def _key(self):
+        return self.pattern, self.times_min, self.times_max
+
+    def subpatterns(self):
+        return [self.pattern]
+
+    def _combine_fragments(self, fragments):
+        template, = fragments
+        labels = _single_step_labels(template)
+        if labels is not None:
+            return self._chain_fragment(labels)
+
+        # Copy the template before connecting it to anything.
+        copies = [template.copy() for _ in range(self.times_max - 1)]
+        fragments = ([template] + copies)[:self.times_min]
+        optional = ([template] + copies)[self.times_min:self.times_max]
+        if fragments and not optional:
+            return nfa.Fragment.chain(*fragments)
+
+        # The optional copies nest, like (x(x(x)?)?)?, so each can skip
+        # straight to the end.  Chaining x?x?x? instead would give every
+        # state an epsilon closure spanning all later copies, making
+        # freezing and determinization quadratic in the bound.
+        start, end = nfa.State(), nfa.State()
+        current = start
+        for copy in optional:
+            current.add_empty_transition(end)
+            current.add_empty_transition(copy.start)
+            current = copy.end
+        current.add_empty_transition(end)
+        return nfa.Fragment.chain(*(fragments + [nfa.Fragment(start, end)]))
+
+    def _chain_fragment(self, labels):
+        """Build the repetition of a one-character pattern as a chain of states.
+
+        The chain has one state per count, each leading to the next along
+        the labels.  Every count from times_min on can skip to the end.
+        """
+        states = [nfa.State() for _ in range(self.times_max + 1)]
+        end = states[-1]
+        for count, (state, follower) in enumerate(zip(states, states[1:])):
+            for label in labels:
+                state.add_labeled_transition(label, follower)
+            if count >= self.times_min:
+                state.add_empty_transition(end)
+        return nfa.Fragment(states[0], end)
 
 
 class Range(Pattern):
-    """Matches any character in an inclusive range of ASCII characters."""
+    """Matches any character in an inclusive range of Unicode code points."""
 
     def __init__(self, low_character, high_character):
         self.low_character = low_character
@@ -172,8 +492,10 @@ class Range(Pattern):
     def __repr__(self):
         return '[%s-%s]' % (self.low_character, self.high_character)
 
-    def _fragment(self):
-        low_index = ord(self.low_character)
-        high_index = ord(self.high_character)
-        chars = ''.join(chr(index) for index in range(low_index, high_index + 1))
-        return pattern.Selection(chars._fragment())
+    def _key(self):
+        return self.low_character, self.high_character
+
+    def _combine_fragments(self, unused_fragments):
+        start, end = nfa.State(), nfa.State()
+        start.add_range_transition(self.low_character, self.high_character, end)
+        return nfa.Fragment(start, end)
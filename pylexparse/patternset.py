@@ -0,0 +1,54 @@
+"""Matching a string against many patterns at once."""
+
+import charsource
+import finiteautomata
+import lazydfa
+import nfa as nfas
+import regex
+
+
+class PatternSet(object):
+    """A set of patterns that are all matched in a single pass.
+
+    Like lexer.Lexer, the patterns' NFAs are joined under one start
+    state, and each pattern's accepting state identifies it.  So, the
+    cost of matching grows with the input, not the number of patterns.
+    """
+
+    def __init__(self, patterns, engine='lazy'):
+        """Args:
+            patterns: A list of regular expression strings or Patterns.
+            engine: The engine for full matches.  See
+                finiteautomata.build_matcher.
+        """
+        self.patterns = list(patterns)
+        self._acceptor_indexes = {}
+        # For each pattern, a string that all of its matches contain.
+        self._required = []
+        start = nfas.State()
+        for i, pattern in enumerate(self.patterns):
+            if isinstance(pattern, basestring):
+                pattern = regex.parse_regex(pattern)
+            self._required.append(pattern.literals().required)
+            fragment = pattern.simplified()._fragment()
+            start.add_empty_transition(fragment.start)
+            self._acceptor_indexes[fragment.end] = i
+
+        # Freezing is done once, and shared by the matcher and searcher.
+        nfa = nfas.Nfa(start, self._acceptor_indexes.keys()).freeze()
+        self._matcher = finiteautomata.build_matcher(nfa, engine)
+        self._searcher = lazydfa.LazyDfa(nfa, unanchored=True)
+
+    def _indexes(self, acceptors):
+        return set(self._acceptor_indexes[acceptor] for acceptor in acceptors)
+
+    def match(self, candidate):
+        """Return the set of indexes of the patterns matching all of a candidate."""
+        return self._indexes(self._matcher.match(candidate))
+
+    def search(self, text):
+        """Return the set of indexes of the patterns matching within a text."""
+        if all(charsource.lacks(text, required) for required in self._required):
+            # No pattern can match, so don't bother scanning.
+            return set()
+        return self._indexes(self._searcher.all_accepts(text))
@@ -0,0 +1,22 @@
+"""Unit tests for patternset."""
+import unittest
+
+import patternset
+
+class TestPatternSet(unittest.TestCase):
+    def test_match_and_search(self):
+        patterns = patternset.PatternSet(['[bm]e*(at|f{4})', 'me+', 'x*', 'at'])
+        self.assertEqual(set([0, 1]), patterns.match('mat') | patterns.match('mee'))
+        self.assertEqual(set([0]), patterns.match('meat'))
+        self.assertEqual(set([2]), patterns.match(''))
+        self.assertEqual(set([0, 1, 2, 3]), patterns.search('a meat'))
+        self.assertEqual(set([2]), patterns.search('bff'))
+
+    def test_nfa_is_frozen_once(self):
+        patterns = patternset.PatternSet(['me+', 'at'], engine='nfa')
+        closed = patterns._matcher.start.closed_transitions
+        self.assertTrue(patterns._matcher.freeze() is patterns._matcher)
+        self.assertTrue(patterns._matcher.start.closed_transitions is closed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@
 
 import sys
 
+import bench
 import graph_printer
 import regex
 
@@ -17,6 +18,9 @@ def main(args):
     if subcommand == 'match':
         _match_regex(args[1], args[2])
 
+    if subcommand == 'bench':
+        sys.exit(bench.main(args[1:]))
+
 def _regex_to_nfa_dot(regex_pattern):
     """Print a DOT graph representing a regular expression."""
     pattern = regex.parse_regex(regex_pattern)
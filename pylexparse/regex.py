@@ -1,14 +1,14 @@
 """Tools for parsing a regular expression into a Pattern."""
 
-import collections
 import string
 
-import charsource
+import cache
 import pattern as p
 
 # Characters that represent themselves in a regular expression.
 # TODO(jasonpr): Handle $ and ^ specially at edges of regex.
 _CHAR_LITERALS = string.ascii_letters + string.digits + '!"#$%&\',-/:;<=>@^_`~]} \t\n\r'
+_LITERAL_SET = frozenset(_CHAR_LITERALS)
 # Characters that represent themselves inside a square-bracket expression.
 _GROUP_CHARS = string.ascii_letters + string.digits + '!"#$%&\'()*+,-./:;<=>?@[^_`{|}~'
 # Characters that represent themselves when escaped with a backslash.
@@ -36,258 +36,270 @@ _BRACKET_CHARACTER_CLASSES = {
     'upper': set(string.ascii_uppercase),
     'xdigit': set(string.hexdigits),
     }
+_LONGEST_CLASS_NAME = max(len(name) for name in _BRACKET_CHARACTER_CLASSES)
 
-def parse_regex(regex_string):
-    """Convert a regular expression string into a Pattern."""
-    return _parse_regex(charsource.GetPutSource(regex_string))
-
-
-# The following _parse_* methods form a recursive descent parser
-# that respect the order of operations in a regular expression.
-def _parse_regex(source):
-    """Parse any regex into a Pattern."""
-    return _parse_alternation(source)
-
-
-def _parse_alternation(source):
-    """Parse an alternation expression, like 'ab|cd|ef'."""
-    parts = []
-    # Act as though the last character was a '|', so we get the
-    # initial element of the alternation.
-    last_char = '|'
-    while last_char == '|':
-        parts.append(_parse_concatenation(source))
-        last_char = source.get()
-    # Put back the non-alternation character.
-    source.put(last_char)
-
-    return p.Or(*parts)
-
-
-def _parse_concatenation(source):
-    """Parse a concatenation expression, like 'abc' or 'a(b|c)d*'."""
-    parts = []
-    duplication = _parse_duplication(source)
-    # If we're expecting a concatenation, there MUST be at least
-    # one (first) element!
-    assert duplication
-    while duplication:
-        parts.append(duplication)
-        duplication = _parse_duplication(source)
-
-    return p.Sequence(*parts)
-
-
-def _parse_duplication(source):
-    """Parse a duplication expression, like 'a*' or '(a|b){3,5}'."""
-    duplicated = _parse_parenthesization(source)
-    if not duplicated:
-        return None
-
-    duplicator = source.get()
-
-    if duplicator == '?':
-        return p.Maybe(duplicated)
-    elif duplicator == '*':
-        return p.Star(duplicated)
-    elif duplicator == '+':
-        return p.Plus(duplicated)
-    elif duplicator == '{':
-        min_repeats = _parse_positive_int(source)
-        range_continuation = source.get()
-
-        # We will ultimately expect a closing curly brace, but
-        # we might see a comma and a max repeats value, first.
-        if range_continuation == ',':
-            max_repeats = _parse_positive_int(source)
-            range_continuation = source.get()
-        else:
-            max_repeats = min_repeats
-
-        if range_continuation != '}':
-            raise ValueError('Expected "}", but got "%s".' %
-                             range_continuation)
-
-        return p.Repeat(duplicated, min_repeats, max_repeats)
-    else:
-        source.put(duplicator)
-        return duplicated
-
-
-def _parse_parenthesization(source):
-    """Parse a parenthesization pattern, like '(a|b)' or '[ab]' or 'a'.
-
-    Note that '[ab]' is a parenthesization, since it is equivalent
-    to '([ab])'.  Similarly, 'a' is equivalent to '(a)'.
-    """
-    first_char = source.get()
-    if first_char == '(':
-        enclosed_regex = _parse_regex(source)
-        close_paren = source.get()
-        assert close_paren == ')'
-        return enclosed_regex
-
-    # Otherwise, this must just be a group.  (Groups have just as
-    # tight of binding as a parenthesization.)
-    source.put(first_char)
-    return _parse_group(source)
+# Maps regular expression string -> Pattern.
+parse_cache = cache.LruCache()
 
+def parse_regex(regex_string):
+    """Convert a regular expression string into a Pattern.
 
-def _parse_group(source):
-    """Parse a group pattern, like '[abc]' or 'a'.
-
-    Note that 'a' is a group, since 'a' is equivalent to '[a]'.
-    """
-    first_char = source.get()
-    if first_char == '[':
-        second_char = source.get()
-        if second_char == '^':
-            negating = True
-        else:
-            source.put(second_char)
-            negating = False
-        group_chars = _parse_group_chars(source)
-        result = p.Selection(group_chars, negating)
-        close_brace = source.get()
-        assert close_brace == ']'
-        return result
-
-    # Otherwise, it's a single normal character.
-    source.put(first_char)
-    return _parse_atom(source)
-
-def _parse_group_chars(source):
-    """Parse the characters from a group specification.
+    Patterns are shared between calls through parse_cache, so callers
+    must not modify them.
 
-    This is just a string of characters allowable in a group specification.
-    For example, a valid parse is 'aA1.?', since '[aA1.?]' is a valid group.
+    Raises ValueError, naming the position of the problem, if the string
+    isn't a valid regular expression.
     """
-    chars = set()
-
-    while True:
-        range_chars = _parse_group_range(source)
-        if range_chars:
-            for char in range_chars:
-                chars.add(char)
-            continue
+    return parse_cache.get(regex_string, lambda: _parse_regex(regex_string))
 
-        char_class = _parse_char_class(source)
-        if char_class:
-            chars |= char_class
-            continue
 
-        char = source.get()
-        if not char:
-            raise ValueError('Unexpected end of stream.')
-        if char not in _GROUP_CHARS:
-            source.put(char)
-            break
-        chars.add(char)
+def _parse_regex(regex_string):
+    return _Parser(regex_string).parse()
 
-    return ''.join(chars)
 
+class _Parser(object):
+    """A parser over one regular expression string.
 
-def _parse_atom(source):
-    """Parse a single regex atom.
-
-    An atom is a period ('.'), a character literal, or an escape sequence.
+    The _parse_* methods respect the order of operations in a regular
+    expression.  Each reads from self.position, and leaves it just past
+    whatever it parsed, so every character is looked at a constant
+    number of times.  Parentheses are tracked on an explicit stack,
+    rather than by recursion, so they can nest arbitrarily deeply.
     """
-    char = source.get()
 
-    if not char:
-        # For good measure, put the EOF back on!
-        # This doesn't really do anything, since the source will
-        # generate EOFs forever.
-        source.put(char)
-        return None
-    elif char == '.':
-        return p.Anything()
-    elif char in _CHAR_LITERALS:
-        return p.String(char)
-    elif char == '\\':
-        escaped = source.get()
-        if escaped in _IDENTIY_ESCAPES:
-            return p.String(escaped)
-        elif escaped in _CHARACTER_CLASSES:
-            return p.Selection(_CHARACTER_CLASSES[escaped])
-        else:
-            raise ValueError('Unexpected escape sequence, \\%s.', escaped)
-    else:
-        source.put(char)
+    def __init__(self, text):
+        self.text = text
+        self.position = 0
+        self._length = len(text)
+
+    def parse(self):
+        """Parse the whole string into a Pattern."""
+        # The alternatives so far, and the parts of the current
+        # concatenation, of each enclosing parenthesization.
+        enclosing = []
+        alternatives, parts = [], []
+        while True:
+            operand = self._parse_group()
+            if operand is not None:
+                parts.append(self._parse_duplication(operand))
+                continue
+
+            char = self._peek()
+            if char == '(':
+                self.position += 1
+                enclosing.append((alternatives, parts))
+                alternatives, parts = [], []
+            elif char == '|':
+                alternatives.append(self._concatenation(parts))
+                parts = []
+                self.position += 1
+            elif char == ')' and enclosing:
+                alternatives.append(self._concatenation(parts))
+                enclosed_regex = p.Or(*alternatives)
+                self.position += 1
+                alternatives, parts = enclosing.pop()
+                parts.append(self._parse_duplication(enclosed_regex))
+            else:
+                break
+
+        alternatives.append(self._concatenation(parts))
+        if enclosing:
+            self._expect(')')
+        if self.position < self._length:
+            self._fail('Unexpected "%s"' % self.text[self.position])
+        return p.Or(*alternatives)
+
+    def _peek(self):
+        """Return the current character, or None at the end."""
+        if self.position < self._length:
+            return self.text[self.position]
         return None
 
-def _parse_positive_int(source):
-    """Parse a positive integer.
-
-    That is, parse a sequence of one or more digits.
-    """
-    digits = []
-    next_char = source.get()
-    assert next_char and next_char in string.digits
-    while next_char and next_char in string.digits:
-        digits.append(next_char)
-        next_char = source.get()
-    source.put(next_char)
-    return int(''.join(digits))
-
-
-def _parse_group_range(source):
-    """Parse a three-character group range expression.
-
-    Return the set of characters represented by the range.
-
-    For example, parsing the expression 'c-e' from the source returns
-    set(['c', 'd', 'e']).
-    """
-    start = source.get()
-    if start not in _GROUP_CHARS:
-        source.put(start)
-        return None
+    def _fail(self, message):
+        raise ValueError('%s at position %d of %r.' %
+                         (message, self.position, self.text))
+
+    def _expect(self, char):
+        """Consume char, or fail if it isn't the current character."""
+        if self._peek() != char:
+            self._fail('Expected "%s"' % char)
+        self.position += 1
+
+    def _concatenation(self, parts):
+        """Join the parts of a concatenation, like 'abc' or 'a(b|c)d*'."""
+        # If we're expecting a concatenation, there MUST be at least
+        # one (first) element!
+        if not parts:
+            self._fail('Expected an expression')
+        return p.Sequence(*parts)
+
+    def _parse_duplication(self, duplicated):
+        """Parse the duplicator after a pattern, as in 'a*' or '(a|b){3,5}'.
+
+        Return the duplicated pattern, or the pattern itself if no
+        duplicator follows it.
+        """
+        duplicator = self._peek()
+        if duplicator == '?':
+            self.position += 1
+            return p.Maybe(duplicated)
+        elif duplicator == '*':
+            self.position += 1
+            return p.Star(duplicated)
+        elif duplicator == '+':
+            self.position += 1
+            return p.Plus(duplicated)
+        elif duplicator == '{':
+            self.position += 1
+            min_repeats = self._parse_positive_int()
+            # We will ultimately expect a closing curly brace, but
+            # we might see a comma and a max repeats value, first.
+            if self._peek() == ',':
+                self.position += 1
+                max_start = self.position
+                max_repeats = self._parse_positive_int()
+                if max_repeats < min_repeats:
+                    self.position = max_start
+                    self._fail('Expected a maximum of at least %d' % min_repeats)
+            else:
+                max_repeats = min_repeats
+            self._expect('}')
+            return p.Repeat(duplicated, min_repeats, max_repeats)
+        return duplicated
 
-    middle = source.get()
-    if middle != '-':
-        source.put(middle)
-        source.put(start)
-        return None
+    def _parse_group(self):
+        """Parse a group pattern, like '[abc]' or 'a'.
+
+        Note that 'a' is a group, since 'a' is equivalent to '[a]'.
+        Return None if there is no group at the current position.
+        """
+        char = self._peek()
+        if char in _LITERAL_SET:
+            # By far the most common case, so skip the calls below.
+            self.position += 1
+            return p.String(char)
+        elif char != '[':
+            # Otherwise, it's a single normal character.
+            return self._parse_atom()
+
+        self.position += 1
+        negating = self._peek() == '^'
+        if negating:
+            self.position += 1
+        result = p.Selection(self._parse_group_chars(), negating)
+        self._expect(']')
+        return result
 
-    end = source.get()
-    if end not in _GROUP_CHARS:
-        source.put(end)
-        source.put(middle)
-        source.put(start)
+    def _parse_group_chars(self):
+        """Parse the characters from a group specification.
+
+        This is just a string of characters allowable in a group
+        specification.  For example, a valid parse is 'aA1.?', since
+        '[aA1.?]' is a valid group.
+        """
+        chars = set()
+
+        while True:
+            char = self._peek()
+            if char is None:
+                self._fail('Unexpected end of pattern')
+            if char not in _GROUP_CHARS:
+                break
+
+            range_chars = self._parse_group_range()
+            if range_chars is not None:
+                chars |= range_chars
+                continue
+
+            char_class = self._parse_char_class()
+            if char_class is not None:
+                chars |= char_class
+                continue
+
+            chars.add(char)
+            self.position += 1
+
+        return ''.join(chars)
+
+    def _parse_group_range(self):
+        """Parse a three-character group range expression.
+
+        Return the set of characters represented by the range, or None if
+        there isn't a range at the current position.
+
+        For example, parsing the expression 'c-e' returns
+        set(['c', 'd', 'e']).
+        """
+        range_text = self.text[self.position:self.position + 3]
+        if (len(range_text) < 3 or range_text[1] != '-' or
+            range_text[2] not in _GROUP_CHARS):
+            return None
+
+        start, unused_dash, end = range_text
+        if end < start:
+            self._fail('Range "%s" is out of order' % range_text)
+        self.position += 3
+        return set(chr(ascii_value)
+                   for ascii_value in range(ord(start), ord(end) + 1))
+
+    def _parse_char_class(self):
+        """Parse a bracket character class, like '[:digit:]'.
+
+        Return the set of characters in the class, or None if there isn't
+        a known class at the current position.
+        """
+        if not self.text.startswith('[:', self.position):
+            return None
+        # Only look as far as the longest name could reach, so runs of '[:'
+        # can't make parsing quadratic.
+        end = self.text.find(':]', self.position + 2,
+                             self.position + 4 + _LONGEST_CLASS_NAME)
+        if end == -1:
+            return None
+        class_contents = _BRACKET_CHARACTER_CLASSES.get(
+            self.text[self.position + 2:end])
+        if class_contents is not None:
+            self.position = end + 2
+        return class_contents
+
+    def _parse_atom(self):
+        """Parse a single regex atom.
+
+        An atom is a period ('.'), a character literal, or an escape
+        sequence.  Return None if there is no atom at the current position.
+        """
+        char = self._peek()
+
+        if char is None:
+            return None
+        elif char == '.':
+            self.position += 1
+            return p.Anything()
+        elif char in _CHAR_LITERALS:
+            self.position += 1
+            return p.String(char)
+        elif char == '\\':
+            escaped = self.text[self.position + 1:self.position + 2]
+            if not escaped:
+                self._fail('Unexpected end of pattern after "\\"')
+            elif escaped in _IDENTIY_ESCAPES:
+                self.position += 2
+                return p.String(escaped)
+            elif escaped in _CHARACTER_CLASSES:
+                self.position += 2
+                return p.Selection(_CHARACTER_CLASSES[escaped])
+            else:
+                self._fail('Unexpected escape sequence, \\%s,' % escaped)
         return None
 
-    range_chars = set()
-    for ascii_value in range(ord(start), ord(end) + 1):
-        range_chars.add(chr(ascii_value))
-    return range_chars
-
-
-def _parse_char_class(source):
-    for class_name, class_contents in _BRACKET_CHARACTER_CLASSES.iteritems():
-        if _parse_verbatim(source, '[:%s:]' % class_name):
-            return class_contents
-    return None
-
-
-def _parse_verbatim(source, desired):
-    """Consume a string, verbatim.
-
-    Return whether the desired string was present.
-
-    If the desired string wasn't present, push back all characters consumed
-    during the execution of this function.
-    """
-    consumed = []
-    for char in desired:
-        consumed.append(source.get())
-        if consumed[-1] != char:
-            break
-    else:
-        # We consumed the whole thing!
-        return True
-    # We broke out when the consumed character diverged from the desired string.
-    # Put everything pack before we return.
-    for to_put_back in reversed(consumed):
-        source.put(to_put_back)
-    return False
+    def _parse_positive_int(self):
+        """Parse a positive integer.
+
+        That is, parse a sequence of one or more digits.
+        """
+        start = self.position
+        while self._peek() is not None and self._peek() in string.digits:
+            self.position += 1
+        if self.position == start:
+            self._fail('Expected a number')
+        return int(self.text[start:self.position])
@@ -1,10 +1,14 @@
 """Unit tests for regex."""
+import sys
 import unittest
 
+import finiteautomata
+import graph
+import pattern
 import regex
 
-def match(regex_string, candidate):
-    return regex.parse_regex(regex_string).match(candidate)
+def match(regex_string, candidate, engine='nfa'):
+    return regex.parse_regex(regex_string).match(candidate, engine)
 
 class TestRegex(unittest.TestCase):
     def test_smoke(self):
@@ -14,5 +18,96 @@ class TestRegex(unittest.TestCase):
         self.assertTrue(match('[bm]e*(at|f{4})', 'meat'))
         self.assertFalse(match('[bm]e*(at|f{4})', 'beaffff'))
 
+    def test_engines(self):
+        for engine in ('dfa', 'table', 'lazy', 'compact'):
+            self.assertFalse(match('[bm]e*(at|f{4})', 'beef', engine))
+            self.assertTrue(match('[bm]e*(at|f{4})', 'beeeeeeeeffff', engine))
+            self.assertTrue(match('[bm]e*(at|f{4})', 'meat', engine))
+            self.assertFalse(match('[bm]e*(at|f{4})', 'beaffff', engine))
+
+    def test_compile_cache(self):
+        self.assertTrue(regex.parse_regex('x(y|z)*') is
+                        regex.parse_regex('x(y|z)*'))
+        compiled = regex.parse_regex('[xy]z').compiled('dfa')
+        hits = pattern.compile_cache.hits
+        # A structurally equal pattern reuses the same automaton.
+        self.assertTrue(regex.parse_regex('[yx]z').compiled('dfa') is compiled)
+        self.assertEqual(hits + 1, pattern.compile_cache.hits)
+
+    def test_match_many(self):
+        candidates = ['beef', 'beeeeeeeeffff', 'meat', 'beaffff'] * 3
+        pattern = regex.parse_regex('[bm]e*(at|f{4})')
+        expected = [False, True, True, False] * 3
+        for engine in ('nfa', 'table'):
+            self.assertEqual(expected, list(pattern.match_many(candidates, engine)))
+        self.assertEqual(expected, list(pattern.match_many(
+            candidates, processes=2, chunk_size=2)))
+
+    def test_match_many_buffers(self):
+        # Required literals can't be looked for in buffers and memoryviews,
+        # so they must not rule those candidates out.
+        pattern = regex.parse_regex('beef|bee')
+        candidates = [memoryview('beef'), buffer('bee'), memoryview('bex')]
+        for engine in ('nfa', 'table'):
+            self.assertEqual([True, True, False],
+                             list(pattern.match_many(candidates, engine)))
+
+    def test_range_transitions(self):
+        # A negated selection is a couple of ranges, not a hundred edges.
+        fragment = pattern.Selection('x', negating=True)._fragment()
+        self.assertEqual(3, len(list(fragment.start)))
+        # Ranges can span all of Unicode.
+        pat = pattern.Sequence(pattern.Range(u'\x00', u'\uffff'),
+                               pattern.String('a'))
+        for engine in finiteautomata.ENGINES:
+            self.assertTrue(pat.match(u'\u4e2da', engine))
+            self.assertTrue(pat.match(u'aa', engine))
+            self.assertFalse(pat.match(u'\u4e2d\u4e2d', engine))
+            self.assertTrue(match('[a-z]x|[^x]y', 'by', engine))
+            self.assertFalse(match('[a-z]x|[^x]y', 'xy', engine))
+
+    def test_bounded_repeat(self):
+        # One state per count, not one fragment per copy.
+        fragment = regex.parse_regex('[0-9]{1,1000}')._fragment()
+        self.assertEqual(1003, len(list(graph.reachable(fragment.start))))
+        for engine in ('nfa', 'table', 'lazy', 'compact'):
+            self.assertTrue(match('[0-9]{1,1000}x', '7' * 1000 + 'x', engine))
+            self.assertFalse(match('[0-9]{1,1000}x', '7' * 1001 + 'x', engine))
+            self.assertTrue(match('(ab|c){0,3}', 'abcab', engine))
+            self.assertFalse(match('(ab|c){2,3}', 'ab', engine))
+            # A zero-count repeat inside another matches only ''.
+            self.assertTrue(match('(a{0}){2}b', 'b', engine))
+            self.assertTrue(match('(([bc]){0,0}){1,2}', '', engine))
+            self.assertFalse(match('(([bc]){0,0}){1,2}', 'b', engine))
+
+    def test_parse_errors(self):
+        for regex_string, position in [('a|', 2), ('(ab', 3), ('a{2,x}', 4),
+                                       ('[ab', 3), ('ab)', 2), (r'a\q', 1),
+                                       ('a{3,2}', 4), ('[z-a]', 1)]:
+            with self.assertRaisesRegexp(ValueError,
+                                         'at position %d of' % position):
+                regex.parse_regex(regex_string)
+        self.assertTrue(match('[[:digit:]x]+', '4x2'))
+        # An unknown class name is just more bracketed characters.
+        self.assertTrue(match('[[:foo:]]', 'f]'))
+
+    def test_deep_pattern(self):
+        depth = sys.getrecursionlimit() + 100
+        def deep_pattern():
+            deep = pattern.String('a')
+            for _ in range(depth):
+                deep = pattern.Plus(pattern.Sequence(deep, pattern.String('b')))
+            return deep
+        deep = deep_pattern()
+        self.assertTrue(deep.match('a' + 'b' * depth))
+        self.assertFalse(deep.match('a' + 'b' * (depth - 1)))
+        # An equal pattern is compared with the first one in compile_cache.
+        self.assertTrue(deep_pattern().compiled() is deep.compiled())
+        self.assertNotEqual(deep, pattern.Plus(deep))
+        nested = '(' * depth + 'a|b' + ')' * depth + 'c'
+        self.assertTrue(match(nested, 'bc'))
+        # Repeats of compound patterns copy the compiled fragment.
+        self.assertTrue(match('((ab){2}c){3}', 'ababcababcababc', 'table'))
+
 if __name__ == '__main__':
     unittest.main()
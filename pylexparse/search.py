@@ -0,0 +1,245 @@
+"""Finding matches anywhere within a text, rather than only at its start."""
+
+import heapq
+
+import charsource
+import compactnfa
+import dfa
+import flatdfa
+import lazydfa
+import nfa as nfas
+
+
+def stepper(matcher):
+    """Describe how to run a matcher one automaton state at a time.
+
+    Return an (initial, step, accepting) tuple: the initial states, a
+    function from a state and character to the states after it, and a
+    predicate for accepting states.
+    """
+    if isinstance(matcher, nfas.Nfa):
+        assert matcher.frozen, 'Only frozen NFAs can be searched.'
+        classify = matcher.classes.classify
+        return (matcher.start_states(),
+                lambda state, char: state.follow_closed(classify(char)),
+                matcher.accepting.__contains__)
+
+    if isinstance(matcher, compactnfa.CompactNfa):
+        # States are the numbers of the bits in the bitsets.
+        return (list(_bits(matcher.start)),
+                lambda state_id, char: _bits(matcher.advance(1 << state_id, char)),
+                lambda state_id: bool(matcher.accepting >> state_id & 1))
+
+    if isinstance(matcher, dfa.Dfa):
+        def step(state, char):
+            next_state = state.follow(char)
+            return () if next_state is None else (next_state,)
+        return [matcher.start], step, matcher.accepting_states.__contains__
+
+    if isinstance(matcher, flatdfa.FlatDfa):
+        def step(state, char):
+            next_state = matcher.next_state(state, char)
+            return () if next_state == flatdfa.DEAD else (next_state,)
+        return [0], step, lambda state: bool(matcher.accepts[state])
+
+    if isinstance(matcher, lazydfa.LazyDfa):
+        def step(state, char):
+            next_state = matcher.next_state(state, char)
+            return () if next_state is None else (next_state,)
+        return [matcher.start], step, lambda state: bool(state.accepts)
+
+    raise ValueError('Cannot search with a %s.' % type(matcher).__name__)
+
+
+def _bits(bitset):
+    """Yield the number of each set bit of a bitset."""
+    while bitset:
+        lowest = bitset & -bitset
+        yield lowest.bit_length() - 1
+        bitset ^= lowest
+
+
+def _usable_literals(text, prefix, required):
+    """Return the prefix and required strings to scan a text for.
+
+    Both are dropped for texts that can't be searched for strings.
+    """
+    if not charsource.can_find(text):
+        return '', ''
+    return prefix, required
+
+
+def search(matcher, text, position=0, prefix='', required=''):
+    """Find the leftmost-longest match within a text.
+
+    Scans the text once from the position, tracking the automaton states
+    of matches that start at every position, along with the leftmost
+    start that reaches each state.
+
+    Args:
+        matcher: An automaton, as built by finiteautomata.build_matcher.
+        text: A str, unicode, buffer, memoryview or mmap.
+        position: The index from which to search.
+        prefix: A string every match starts with, if known.  The scan
+            skips straight to its occurrences.
+        required: A string every match contains, if known.  If it isn't
+            in the text, the scan is skipped entirely.
+    Return the (start, end) span of the match, or None.
+    """
+    prefix, required = _usable_literals(text, prefix, required)
+    if charsource.lacks(text, required, position):
+        return None
+
+    initial, step, accepting = stepper(matcher)
+    end = len(text)
+
+    # Maps automaton state -> leftmost start of a match reaching it.
+    threads = {}
+    best = None
+    while True:
+        if prefix and not threads and best is None:
+            # Nothing is in progress, so skip to where a match can start.
+            position = text.find(prefix, position)
+            if position == -1:
+                return None
+        if best is None:
+            # No match yet, so a match could still start here.
+            for state in initial:
+                threads.setdefault(state, position)
+
+        accepted_starts = [start for state, start in threads.iteritems()
+                           if accepting(state)]
+        if accepted_starts:
+            leftmost = min(accepted_starts)
+            if best is None or leftmost <= best[0]:
+                best = leftmost, position
+            # Matches starting further right can no longer win.
+            threads = dict((state, start) for state, start in threads.iteritems()
+                           if start <= best[0])
+
+        if position >= end or (best is not None and not threads):
+            return best
+
+        char = text[position]
+        next_threads = {}
+        for state, start in threads.iteritems():
+            for next_state in step(state, char):
+                if next_threads.get(next_state, end + 1) > start:
+                    next_threads[next_state] = start
+        threads = next_threads
+        position += 1
+
+
+def finditer(matcher, text, prefix='', required=''):
+    """Yield the (start, end) span of each non-overlapping match in a text.
+
+    Like search, matches are leftmost-longest.  After an empty match, the
+    next match starts at least one character later.
+
+    The text is scanned once.  Matches that start while an earlier match
+    may still grow are tracked alongside it, so each match is reported
+    with the automaton states of later ones already in hand.  The states
+    of a thread that starts inside a reported match are dropped.  Only
+    if such a thread had absorbed one that starts at or after the
+    match's end is the text from there scanned again.
+    """
+    prefix, required = _usable_literals(text, prefix, required)
+
+    initial, step, accepting = stepper(matcher)
+    end = len(text)
+
+    # Maps automaton state -> leftmost start of a match reaching it.
+    threads = {}
+    # Maps start -> end of the longest match from it so far.
+    ends = {}
+    # A heap of the keys of ends.
+    starts = []
+    # Maps start -> the latest start that merged into one of its threads.
+    absorbed = {}
+    # Starts that merged into an accepting thread as soon as they began.
+    absorbed_accepting = set()
+    # Matches may start from here on.
+    resume = position = 0
+    required_at = -1
+
+    while resume <= end:
+        if required and required_at < resume:
+            required_at = text.find(required, resume)
+            if required_at == -1:
+                return
+        if prefix and not threads and not starts and position >= resume:
+            # Nothing is in progress, so skip to where a match can start.
+            position = text.find(prefix, position)
+            if position == -1:
+                return
+        if position >= resume:
+            for state in initial:
+                start = threads.setdefault(state, position)
+                if start != position:
+                    _absorb(absorbed, start, position)
+                    if accepting(state):
+                        absorbed_accepting.add(position)
+
+        for state, start in threads.iteritems():
+            if accepting(state):
+                if start not in ends:
+                    heapq.heappush(starts, start)
+                ends[start] = position
+
+        # The leftmost match is final once no thread could reach further
+        # left or make it longer.
+        restart = False
+        while starts and (position == end or not threads or
+                          min(threads.itervalues()) > starts[0]):
+            match_start = starts[0]
+            match_end = ends[match_start]
+            yield match_start, match_end
+            old_resume = resume
+            resume = match_end if match_end > match_start else match_end + 1
+
+            # Threads from inside the match are about to be dropped.  Any
+            # start at or past resume that merged into them, or an empty
+            # match at resume that merged into the match itself, would be
+            # lost along with them.
+            if resume == match_end and match_end in absorbed_accepting:
+                restart = True
+            for start in xrange(match_start + 1, resume):
+                if absorbed.get(start, -1) >= resume:
+                    restart = True
+            if restart:
+                threads, ends, starts, absorbed = {}, {}, [], {}
+                absorbed_accepting.clear()
+                position = resume
+                break
+
+            while starts and starts[0] < resume:
+                del ends[heapq.heappop(starts)]
+            for start in xrange(old_resume, resume):
+                absorbed.pop(start, None)
+                absorbed_accepting.discard(start)
+            threads = dict((state, start) for state, start in threads.iteritems()
+                           if start >= resume)
+
+        if restart:
+            continue
+        if position >= end:
+            return
+
+        char = text[position]
+        next_threads = {}
+        for state, start in threads.iteritems():
+            for next_state in step(state, char):
+                other = next_threads.setdefault(next_state, start)
+                if other < start:
+                    _absorb(absorbed, other, start)
+                elif other > start:
+                    _absorb(absorbed, start, other)
+                    next_threads[next_state] = start
+        threads = next_threads
+        position += 1
+
+
+def _absorb(absorbed, start, later_start):
+    """Record that a thread from a later start merged into one from start."""
+    absorbed[start] = max(absorbed.get(start, -1), later_start,
+                          absorbed.get(later_start, -1))
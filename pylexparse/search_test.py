@@ -0,0 +1,31 @@
+"""Unit tests for search."""
+import unittest
+
+import finiteautomata
+import regex
+import search
+import stats
+
+class TestSearch(unittest.TestCase):
+    def test_search(self):
+        pattern = regex.parse_regex('[bm]e*(at|f{4})')
+        text = 'a beef, a meat, a beeffff'
+        for engine in finiteautomata.ENGINES:
+            self.assertEqual((10, 14), pattern.search(text, engine))
+            self.assertEqual([(10, 14), (18, 25)],
+                             list(pattern.finditer(text, engine)))
+        self.assertEqual(None, pattern.search('beef'))
+
+    def test_finditer_reads_once(self):
+        # finditer reads each character once, even while a longer match
+        # from earlier is still possible.
+        pattern = regex.parse_regex('a|a*b')
+        for engine in finiteautomata.ENGINES:
+            for length in (100, 1000):
+                text = stats.CountingBuffer('a' * length)
+                self.assertEqual([(i, i + 1) for i in range(length)], list(
+                    search.finditer(pattern.compiled(engine), text)))
+                self.assertEqual(length, len(text.chars_read))
+
+if __name__ == '__main__':
+    unittest.main()
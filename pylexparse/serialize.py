@@ -0,0 +1,485 @@
+"""A compact, versioned binary format for compiled automata and lexers.
+
+Files start with a header: the magic string 'PLXP', a format version,
+and a byte naming the kind of payload.  Payloads are built from
+length-prefixed arrays of little-endian 32-bit integers and
+length-prefixed strings.  Files are read by memory-mapping them, so
+loading costs little more than copying the arrays out.
+"""
+
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import charclasses
+import compactnfa
+import flatdfa
+import graph
+import lazydfa
+import lexer
+import nfa as nfas
+
+MAGIC = 'PLXP'
+FORMAT_VERSION = 3
+
+_HEADER = struct.Struct('<4sHc')
+_COUNT = struct.Struct('<I')
+
+# Kinds of payload.
+_NFA = 'N'
+_FLAT_DFA = 'T'
+_LEXER = 'L'
+
+# Transition labels that aren't characters, stored in place of a
+# character code.
+_EMPTY_LABEL = -1
+_EOF_LABEL = -2
+
+# The payload kind that stores each lexer engine's matcher.
+_ENGINE_PAYLOADS = {
+    'nfa': _NFA,
+    'lazy': _NFA,
+    'compact': _NFA,
+    'table': _FLAT_DFA,
+    }
+
+
+class FormatError(ValueError):
+    """Raised when a file is not in a format this module can load."""
+
+
+def _encode_label(char):
+    if char == '':
+        return _EMPTY_LABEL
+    if char is None:
+        return _EOF_LABEL
+    return ord(char)
+
+
+def _decode_label(code):
+    if code == _EMPTY_LABEL:
+        return ''
+    if code == _EOF_LABEL:
+        return None
+    if not 0 <= code <= sys.maxunicode:
+        raise FormatError('Invalid character code %d.' % code)
+    return unichr(code) if code > 127 else chr(code)
+
+
+def _check_ids(ids, limit, what):
+    """Raise FormatError unless every id is in range(limit)."""
+    if ids and not 0 <= min(ids) <= max(ids) < limit:
+        raise FormatError('%s out of range.' % what)
+
+
+def _encode_range(label):
+    """Encode a transition label as a (low, high) pair of codes.
+
+    Labels that aren't ranges have high equal to low.
+    """
+    if isinstance(label, tuple):
+        low, high = label
+        return ord(low), ord(high)
+    code = _encode_label(label)
+    return code, code
+
+
+def _ints(values):
+    """Encode a sequence of integers."""
+    values = array.array('i', values)
+    assert values.itemsize == 4
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return _COUNT.pack(len(values)) + values.tostring()
+
+
+def _string(value):
+    """Encode a string."""
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return _COUNT.pack(len(value)) + value
+
+
+class _Reader(object):
+    """Reads encoded values from a buffer, in order."""
+
+    def __init__(self, buffer_):
+        self._buffer = buffer_
+        self._offset = 0
+
+    def _take(self, size):
+        end = self._offset + size
+        if end > len(self._buffer):
+            raise FormatError('Unexpected end of file.')
+        data = self._buffer[self._offset:end]
+        self._offset = end
+        return data
+
+    def unpack(self, struct_):
+        return struct_.unpack(self._take(struct_.size))
+
+    def ints(self):
+        count, = self.unpack(_COUNT)
+        values = array.array('i')
+        values.fromstring(self._take(count * values.itemsize))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    def int(self):
+        values = self.ints()
+        if len(values) != 1:
+            raise FormatError('Expected one integer, found %d.' % len(values))
+        return values[0]
+
+    def byte(self):
+        return self._take(1)
+
+    def string(self):
+        size, = self.unpack(_COUNT)
+        return self._take(size)
+
+
+def _check_offsets(offsets, num_values, what):
+    """Raise FormatError unless offsets split num_values values in order."""
+    if (not offsets or offsets[0] != 0 or offsets[-1] != num_values or
+            sorted(offsets) != list(offsets)):
+        raise FormatError('Invalid %s offsets.' % what)
+
+
+def _nfa_payload(automaton, acceptors):
+    """Encode an NFA, whose acceptors are listed in order.
+
+    A frozen NFA's closures and character classes are saved too, so it
+    is loaded frozen, without computing them again.
+    """
+    states, state_ids = graph.numbered(automaton.start)
+    sources, labels, highs, destinations = [], [], [], []
+    for state_id, state in enumerate(states):
+        for label, destination in state:
+            low, high = _encode_range(label)
+            sources.append(state_id)
+            labels.append(low)
+            highs.append(high)
+            destinations.append(state_ids[destination])
+    return ''.join([
+        _ints([len(states)]),
+        _ints(sources),
+        _ints(labels),
+        _ints(highs),
+        _ints(destinations),
+        _ints(state_ids[acceptor] for acceptor in acceptors),
+        _ints([automaton.frozen]),
+        _frozen_payload(automaton, states, state_ids) if automaton.frozen else '',
+        ])
+
+
+def _frozen_payload(automaton, states, state_ids):
+    """Encode the closures and character classes of a frozen NFA."""
+    # Closures are shared between transitions, so save each one once.
+    closure_ids = {}
+    set_offsets, set_members = [0], []
+    def closure_id(closure):
+        if closure not in closure_ids:
+            closure_ids[closure] = len(closure_ids)
+            set_members.extend(sorted(state_ids[state] for state in closure))
+            set_offsets.append(len(set_members))
+        return closure_ids[closure]
+
+    start_set = closure_id(automaton.start_states())
+    sources, classes, closures = [], [], []
+    for state_id, state in enumerate(states):
+        for char_class, closure in sorted(state.closed_transitions.iteritems()):
+            sources.append(state_id)
+            classes.append(char_class)
+            closures.append(closure_id(closure))
+    return ''.join([
+        _ints(automaton.classes.boundaries),
+        _ints([automaton.classes.has_eof]),
+        _ints(set_offsets),
+        _ints(set_members),
+        _ints([start_set]),
+        _ints(sources),
+        _ints(classes),
+        _ints(closures),
+        ])
+
+
+def _read_nfa(reader):
+    """Decode an NFA.  Return (nfa.Nfa, list of acceptors)."""
+    num_states = reader.int()
+    if num_states < 1:
+        raise FormatError('An NFA needs a start state.')
+    states = [nfas.State() for _ in xrange(num_states)]
+    sources, labels, highs = reader.ints(), reader.ints(), reader.ints()
+    destinations = reader.ints()
+    if not len(sources) == len(labels) == len(highs) == len(destinations):
+        raise FormatError('Transition arrays differ in length.')
+    _check_ids(sources, num_states, 'Transition source')
+    _check_ids(destinations, num_states, 'Transition destination')
+    for source, label, high, destination in zip(
+            sources, labels, highs, destinations):
+        if high != label:
+            if not 0 <= label < high:
+                raise FormatError('Invalid range %d-%d.' % (label, high))
+            states[source].add_range_transition(
+                _decode_label(label), _decode_label(high), states[destination])
+        else:
+            states[source].add_transition(
+                _decode_label(label), states[destination])
+    acceptor_ids = reader.ints()
+    _check_ids(acceptor_ids, num_states, 'Acceptor')
+    acceptors = [states[state_id] for state_id in acceptor_ids]
+    automaton = nfas.Nfa(states[0], acceptors)
+    if reader.int():
+        _read_frozen(reader, automaton, states)
+    return automaton, acceptors
+
+
+def _read_frozen(reader, automaton, states):
+    """Decode a frozen NFA's closures and character classes, and freeze it."""
+    boundaries = reader.ints()
+    has_eof = reader.int()
+    classes = charclasses.CharClasses(boundaries, bool(has_eof))
+    set_offsets, set_members = reader.ints(), reader.ints()
+    start_set = reader.int()
+    sources, char_classes, closures = reader.ints(), reader.ints(), reader.ints()
+
+    _check_offsets(set_offsets, len(set_members), 'closure')
+    _check_ids(set_members, len(states), 'Closure member')
+    num_sets = len(set_offsets) - 1
+    _check_ids([start_set], num_sets, 'Start closure')
+    if not len(sources) == len(char_classes) == len(closures):
+        raise FormatError('Closure arrays differ in length.')
+    _check_ids(sources, len(states), 'Closure source')
+    _check_ids(char_classes, classes.num_classes, 'Character class')
+    _check_ids(closures, num_sets, 'Closure')
+
+    sets = [frozenset(states[i] for i in set_members[begin:end])
+            for begin, end in zip(set_offsets, set_offsets[1:])]
+    for state in states:
+        state.closed_transitions = {}
+    for source, char_class, closure in zip(sources, char_classes, closures):
+        states[source].closed_transitions[char_class] = sets[closure]
+    automaton.mark_frozen(classes, sets[start_set])
+
+
+def _flat_dfa_payload(automaton, acceptors):
+    """Encode a FlatDfa, whose acceptors are listed in order."""
+    acceptor_ids = dict((acceptor, i) for i, acceptor in enumerate(acceptors))
+    char_classes = automaton.char_classes
+    accept_offsets, accept_ids = [0], []
+    for accepts in automaton.accepts:
+        accept_ids.extend(sorted(acceptor_ids[acceptor] for acceptor in accepts))
+        accept_offsets.append(len(accept_ids))
+    return ''.join([
+        _ints([automaton.num_classes]),
+        _ints(automaton.table),
+        _ints(char_classes.boundaries),
+        _ints([char_classes.has_eof]),
+        _ints(automaton.columns),
+        _ints(accept_offsets),
+        _ints(accept_ids),
+        _ints([len(acceptors)]),
+        ])
+
+
+def _read_flat_dfa(reader):
+    """Decode a FlatDfa.  Return (flatdfa.FlatDfa, list of acceptors)."""
+    num_classes = reader.int()
+    table = reader.ints()
+    boundaries = reader.ints()
+    has_eof = reader.int()
+    char_classes = charclasses.CharClasses(boundaries, bool(has_eof))
+    columns = list(reader.ints())
+    accept_offsets, accept_ids = reader.ints(), reader.ints()
+    num_acceptors = reader.int()
+
+    num_states = len(accept_offsets) - 1
+    if num_states < 1 or num_classes < 1:
+        raise FormatError('A table DFA needs a start state and a column.')
+    if len(table) != num_states * num_classes:
+        raise FormatError('The table has the wrong size.')
+    # DEAD is -1, so shift it into range.
+    _check_ids([destination + 1 for destination in table], num_states + 1,
+               'Table entry')
+    if len(columns) != char_classes.num_classes:
+        raise FormatError('Expected %d columns, found %d.' %
+                          (char_classes.num_classes, len(columns)))
+    _check_ids(columns, num_classes, 'Column')
+    _check_offsets(accept_offsets, len(accept_ids), 'acceptor')
+    _check_ids(accept_ids, num_acceptors, 'Acceptor')
+    # The acceptors only need to be distinct objects.
+    acceptors = [nfas.State() for _ in xrange(num_acceptors)]
+    accepts = [
+        frozenset(acceptors[i] for i in accept_ids[begin:end])
+        for begin, end in zip(accept_offsets, accept_offsets[1:])]
+    return (flatdfa.FlatDfa(table, num_classes, accepts, char_classes, columns),
+            acceptors)
+
+
+_PAYLOAD_WRITERS = {
+    _NFA: _nfa_payload,
+    _FLAT_DFA: _flat_dfa_payload,
+    }
+
+_PAYLOAD_READERS = {
+    _NFA: _read_nfa,
+    _FLAT_DFA: _read_flat_dfa,
+    }
+
+
+def _payload_kind(automaton):
+    if isinstance(automaton, nfas.Nfa):
+        return _NFA
+    if isinstance(automaton, flatdfa.FlatDfa):
+        return _FLAT_DFA
+    raise ValueError('Cannot serialize a %s.' % type(automaton).__name__)
+
+
+def _engine_payload_kind(engine):
+    try:
+        return _ENGINE_PAYLOADS[engine]
+    except KeyError:
+        raise ValueError('Cannot serialize a lexer with engine "%s".' % engine)
+
+
+def _lexer_payload(lex):
+    payload_kind = _engine_payload_kind(lex.engine)
+    matcher = lex.matcher
+    if lex.engine in ('lazy', 'compact'):
+        matcher = matcher.nfa
+    parts = [_string(lex.engine), _ints([len(lex.rules)])]
+    for rule in lex.rules:
+        parts.append(_string(rule.name))
+        parts.append(_string(rule.regex))
+        parts.append(_ints([rule.emitted]))
+    parts.append(payload_kind)
+    parts.append(_PAYLOAD_WRITERS[payload_kind](matcher, lex.acceptors))
+    return ''.join(parts)
+
+
+def _read_lexer(reader):
+    engine = reader.string()
+    num_rules = reader.int()
+    rules = []
+    for _ in xrange(num_rules):
+        name = reader.string()
+        regex = reader.string()
+        emitted = reader.int()
+        rules.append(lexer.Rule(name, regex, bool(emitted)))
+    payload_kind = reader.byte()
+    if _ENGINE_PAYLOADS.get(engine) != payload_kind:
+        raise FormatError('Unexpected payload kind "%s" for engine "%s".' %
+                          (payload_kind, engine))
+    matcher, acceptors = _PAYLOAD_READERS[payload_kind](reader)
+    if len(acceptors) != num_rules + 1:
+        raise FormatError('Expected %d acceptors, found %d.' %
+                          (num_rules + 1, len(acceptors)))
+    # Saved NFAs are frozen already, so freezing does nothing here.
+    if engine == 'nfa':
+        matcher = matcher.freeze()
+    elif engine == 'lazy':
+        matcher = lazydfa.LazyDfa(matcher.freeze())
+    elif engine == 'compact':
+        matcher = compactnfa.compact(matcher.freeze())
+    return lexer.Lexer.from_matcher(rules, engine, matcher, acceptors)
+
+
+def _write(path, kind, payload):
+    """Write a file atomically, so concurrent readers never see half of it."""
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as output:
+        output.write(_HEADER.pack(MAGIC, FORMAT_VERSION, kind))
+        output.write(payload)
+    os.rename(output.name, path)
+
+
+def _read(path, expected_kind, read_payload):
+    with open(path, 'rb') as input_file:
+        try:
+            mapped = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise FormatError('%s is empty.' % path)
+    try:
+        reader = _Reader(mapped)
+        magic, version, kind = reader.unpack(_HEADER)
+        if magic != MAGIC:
+            raise FormatError('%s is not a pylexparse file.' % path)
+        if version != FORMAT_VERSION:
+            raise FormatError('%s has format version %d, but expected %d.' %
+                              (path, version, FORMAT_VERSION))
+        if kind not in expected_kind:
+            raise FormatError('%s holds the wrong kind of object.' % path)
+        return read_payload(kind, reader)
+    finally:
+        mapped.close()
+
+
+def save_automaton(automaton, path):
+    """Save an nfa.Nfa or flatdfa.FlatDfa to a file."""
+    kind = _payload_kind(automaton)
+    if kind == _NFA:
+        acceptors = list(automaton.accepting)
+    else:
+        acceptors = list(frozenset().union(*automaton.accepts))
+    _write(path, kind, _PAYLOAD_WRITERS[kind](automaton, acceptors))
+
+
+def load_automaton(path):
+    """Load an automaton saved by save_automaton.
+
+    The accepting NFA states of a loaded automaton are new objects.
+    """
+    return _read(path, _PAYLOAD_READERS.keys(),
+                 lambda kind, reader: _PAYLOAD_READERS[kind](reader)[0])
+
+
+def save_lexer(lex, path):
+    """Save a lexer, including its compiled matcher, to a file."""
+    _write(path, _LEXER, _lexer_payload(lex))
+
+
+def load_lexer(path):
+    """Load a lexer saved by save_lexer, without recompiling it."""
+    return _read(path, [_LEXER], lambda kind, reader: _read_lexer(reader))
+
+
+def rules_key(rules, engine):
+    """Return a hash identifying a compiled lexer for a list of rules."""
+    digest = hashlib.sha1()
+    digest.update(_ints([FORMAT_VERSION]))
+    digest.update(_string(engine))
+    for rule in rules:
+        digest.update(_string(rule.name))
+        digest.update(_string(rule.regex))
+        digest.update(_ints([rule.emitted]))
+    return digest.hexdigest()
+
+
+def cached_lexer(rules, directory, engine='nfa'):
+    """Get a lexer for a list of rules, compiling it at most once.
+
+    Compiled lexers are saved in the directory, under a hash of the
+    rules, and loaded from there by later calls.  Raises ValueError,
+    before compiling anything, if lexers for the engine can't be saved.
+
+    Loading skips the compile work: 'nfa' and 'lazy' lexers load with
+    their NFA already frozen, and 'table' ones with their table.  A
+    'compact' lexer still converts its frozen NFA to bitsets on load.
+    """
+    _engine_payload_kind(engine)
+    path = os.path.join(directory, 'lexer-%s.plx' % rules_key(rules, engine))
+    try:
+        return load_lexer(path)
+    except (IOError, FormatError):
+        pass
+    result = lexer.Lexer(rules, engine)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    save_lexer(result, path)
+    return result
@@ -0,0 +1,78 @@
+"""Unit tests for serialize."""
+import os
+import shutil
+import tempfile
+import unittest
+
+import lexer
+import lexer_test
+import nfa
+import regex
+import serialize
+
+class TestSerialize(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_automaton_round_trip(self):
+        path = os.path.join(self.directory, 'automaton')
+        for engine in ('nfa', 'table'):
+            serialize.save_automaton(
+                regex.parse_regex('[bm]e*(at|f{4})').compiled(engine), path)
+            loaded = serialize.load_automaton(path)
+            self.assertTrue(loaded.match('meat'))
+            self.assertFalse(loaded.match('beaffff'))
+
+    def test_cached_lexer(self):
+        for engine in ('nfa', 'table', 'lazy', 'compact'):
+            compiled = serialize.cached_lexer(
+                lexer_test.RULES, self.directory, engine)
+            loaded = serialize.cached_lexer(
+                lexer_test.RULES, self.directory, engine)
+            self.assertEqual([str(token) for token in compiled.lex('if iffy 42')],
+                             [str(token) for token in loaded.lex('if iffy 42')])
+        self.assertEqual(4, len(os.listdir(self.directory)))
+
+    def test_load_skips_freezing(self):
+        path = os.path.join(self.directory, 'lexer')
+        epsilon_closure = nfa.epsilon_closure
+        for engine in ('nfa', 'lazy', 'compact'):
+            serialize.save_lexer(lexer.Lexer(lexer_test.RULES, engine), path)
+            # Loading must not compute any closures.
+            nfa.epsilon_closure = None
+            try:
+                loaded = serialize.load_lexer(path)
+            finally:
+                nfa.epsilon_closure = epsilon_closure
+            self.assertEqual(["IF('if')", "IDENTIFIER('iffy')", "NUMBER('42')"],
+                             [str(token) for token in loaded.lex('if iffy 42')])
+
+    def test_cached_lexer_rejects_dfa_engine(self):
+        # The engine is rejected before anything is compiled or created.
+        directory = os.path.join(self.directory, 'lexers')
+        self.assertRaises(ValueError, serialize.cached_lexer,
+                          lexer_test.RULES, directory, 'dfa')
+        self.assertFalse(os.path.exists(directory))
+
+    def test_rejects_other_files(self):
+        path = os.path.join(self.directory, 'garbage')
+        with open(path, 'w') as garbage:
+            garbage.write('not a lexer at all')
+        self.assertRaises(serialize.FormatError, serialize.load_lexer, path)
+
+    def test_rejects_bad_state_ids(self):
+        path = os.path.join(self.directory, 'corrupt')
+        with open(path, 'wb') as corrupt:
+            corrupt.write(serialize._HEADER.pack(
+                serialize.MAGIC, serialize.FORMAT_VERSION, serialize._NFA))
+            # Two states, with a transition to a third that does not exist.
+            for values in ([2], [0], [97], [97], [2], [1]):
+                corrupt.write(serialize._ints(values))
+        self.assertRaises(serialize.FormatError,
+                          serialize.load_automaton, path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Opt-in statistics about where lexing time goes.
+
+Pass a Stats to lexer.Lexer to fill it in.  Lexers without one run
+exactly the same code as before, so statistics cost nothing unless they
+are asked for.
+"""
+
+import collections
+import contextlib
+import timeit
+
+import charsource
+import compactnfa
+import lazydfa
+import nfa as nfas
+import regex
+import search
+
+
+class Stats(object):
+    """Counters filled in by a lexer as it compiles and runs.
+
+    tokens: A Counter of the tokens lexed per rule name.
+    chars_consumed: The number of characters in tokens.
+    chars_reread: The number of characters read past the end of a
+        token while looking for a longer match, which must be read again
+        for the next token.
+    rereads: A Counter of chars_reread per rule name.
+    state_set_sizes: A Counter of the steps taken per number of active
+        NFA states, for the NFA engines ('nfa', 'compact' and 'lazy').
+    timings: A dict mapping each compile phase to its total seconds.
+    """
+
+    def __init__(self):
+        self.tokens = collections.Counter()
+        self.chars_consumed = 0
+        self.chars_reread = 0
+        self.rereads = collections.Counter()
+        self.state_set_sizes = collections.Counter()
+        self.timings = collections.defaultdict(float)
+
+    @contextlib.contextmanager
+    def timed(self, phase):
+        """Add the time spent in a with block to a phase's timing."""
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.timings[phase] += timeit.default_timer() - start
+
+    def record_token(self, rule_name, consumed, chars_read):
+        """Count a token, given the characters read while matching it."""
+        # The EOF (None) isn't a character.
+        reread = sum(1 for char in chars_read if char is not None) - consumed
+        self.tokens[rule_name] += 1
+        self.chars_consumed += consumed
+        self.chars_reread += reread
+        self.rereads[rule_name] += reread
+
+    def record_steps(self, matcher, chars_read):
+        """Count the active NFA states at each step of a match.
+
+        Replays the characters through the matcher's NFA, so this costs
+        about as much as the match itself.  DFA engines are skipped,
+        since their state sets were fixed at compile time.
+        """
+        if isinstance(matcher, lazydfa.LazyDfa):
+            matcher = matcher.nfa
+        if not isinstance(matcher, (nfas.Nfa, compactnfa.CompactNfa)):
+            return
+        initial, step, unused_accepting = search.stepper(matcher)
+        active = set(initial)
+        for char in chars_read:
+            if not active:
+                break
+            self.state_set_sizes[len(active)] += 1
+            active = set(next_state for state in active
+                         for next_state in step(state, char))
+
+    def cache_hit_rates(self):
+        """Return the hit rates of the caches lexers compile through.
+
+        Lexers parse their rules through regex.parse_cache, which the
+        whole process shares, so its rate covers every parse so far, not
+        only this lexer's.
+        """
+        return {
+            'parse': regex.parse_cache.hit_rate(),
+            }
+
+    def summary(self):
+        """Return the statistics as a dict of plain, JSON-friendly values."""
+        steps = sum(self.state_set_sizes.itervalues())
+        total_states = sum(size * count
+                           for size, count in self.state_set_sizes.iteritems())
+        return {
+            'tokens': dict(self.tokens),
+            'chars_consumed': self.chars_consumed,
+            'chars_reread': self.chars_reread,
+            'rereads': dict(self.rereads),
+            'mean_state_set_size': float(total_states) / steps if steps else 0.0,
+            'max_state_set_size': max(self.state_set_sizes or [0]),
+            'timings': dict(self.timings),
+            'process_cache_hit_rates': self.cache_hit_rates(),
+            }
+
+
+@contextlib.contextmanager
+def _untimed():
+    yield
+
+
+def timed(stats, phase):
+    """Time a with block into stats, or do nothing if stats is None."""
+    if stats is None:
+        return _untimed()
+    return stats.timed(phase)
+
+
+class CountingSource(charsource.RewindSource):
+    """A RewindSource that remembers every character read from it."""
+
+    def __init__(self, iterable):
+        super(CountingSource, self).__init__(iterable)
+        self.chars_read = []
+
+    def get(self):
+        char = super(CountingSource, self).get()
+        self.chars_read.append(char)
+        return char
+
+    def take_chars_read(self):
+        """Return the characters read since the last call, and forget them."""
+        chars_read, self.chars_read = self.chars_read, []
+        return chars_read
+
+
+class CountingBuffer(object):
+    """Wraps a buffer, remembering every character read from it by index."""
+
+    def __init__(self, buffer_):
+        self._buffer = buffer_
+        self.chars_read = []
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def __getitem__(self, index):
+        char = self._buffer[index]
+        self.chars_read.append(char)
+        return char